@@ -2,24 +2,33 @@
 # boleta_api/extraccion.py
 import re
 import os
+import hashlib
+import heapq
 import unicodedata
 import pytesseract
 import numpy as np
 from boleta_api.db_connection import get_connection
-from typing import Optional, Dict, List, Union, Tuple
+from typing import Optional, Dict, List, Union, Tuple, Iterable, Iterator
 from datetime import datetime, date, timedelta
 from django.db import transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Greatest
 from django.core.exceptions import ValidationError
-from pdf2image import convert_from_bytes
+from django.core.cache import cache
+from django.utils import timezone
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
 from pdf2image.exceptions import PDFInfoNotInstalledError, PDFPageCountError
 from PIL import Image, UnidentifiedImageError, ImageFilter, ImageOps, ExifTags
 import pdfplumber
 from decimal import Decimal, InvalidOperation
 import logging
+from functools import lru_cache
+from itertools import islice
 from boleta_api.ocr_utils import procesar_imagen_camara, procesar_pdf
 from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 import tempfile
+import subprocess
 import cv2
 from pyzbar import pyzbar
 
@@ -28,9 +37,59 @@ from pyzbar import pyzbar
 # =======================#
 CAMPOS_CLAVE = ["ruc", "razon_social", "fecha", "numero_documento", "total", "tipo_documento", "concepto"]
 
+# ===========================#
+# PATRONES REGEX COMPILADOS  #
+# ===========================#
+# Patrones genéricos compartidos; los propios de cada detector van junto a él
+_RE_ESPACIOS = re.compile(r"\s{2,}")
+_RE_BLANCOS = re.compile(r"\s+")
+_RE_NO_UTIL = re.compile(r"[^A-Z0-9\.\,\-\/&\s]")
+_RE_SEPARADOR_ESPACIOS = re.compile(r"\s*([-/])\s*")
+# Sobre una línea ya recortada: numeritos iniciales (grupo 1) o espacios múltiples
+_RE_LIMPIEZA_LINEA = re.compile(r"^(\d+\s+)|\s{2,}")
+_RE_NO_MONTO = re.compile(r"[^\d,.\-]")
+_RE_NO_DIGITO = re.compile(r"[^\d]")
+_RE_DIGITO = re.compile(r"\d")
+
 # =====================#
 # NORMALIZAR TEXTO OCR #
 # =====================#
+# Latin-1 y Latin extendido -> su parte ASCII tras NFKD (á -> a, ñ -> n, º -> o, ¿ -> "")
+MAPA_SIN_TILDES = {
+    c: unicodedata.normalize("NFKD", chr(c)).encode("ascii", "ignore").decode("ascii")
+    for c in range(0x80, 0x250)
+}
+
+def quitar_tildes(texto: str) -> str:
+    """
+    Equivale a NFKD + descartar lo no ASCII. El caso común (ASCII o tildes
+    españolas) se resuelve con str.translate sin pasar por bytes; solo los
+    caracteres fuera de la tabla caen a unicodedata.
+    """
+    if texto.isascii():
+        return texto
+    texto = texto.translate(MAPA_SIN_TILDES)
+    if texto.isascii():
+        return texto
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+
+# Reemplazos típicos de OCR; las claves largas primero para que "S . A . C" gane a "S . A"
+REEMPLAZOS_OCR = {
+    "5A": "S.A",
+    "$.A.C": "S.A.C",
+    "S , A": "S.A",
+    "S . A . C": "S.A.C",
+    "S . A": "S.A",
+    "3.A.C": "S.A.C",
+    "SAC.": "S.A.C",
+    "SA.": "S.A.",
+    "E/": "11/",
+    "RETALE": "RETAIL"
+}
+_RE_REEMPLAZOS_OCR = re.compile(
+    "|".join(map(re.escape, sorted(REEMPLAZOS_OCR, key=len, reverse=True)))
+)
+
 def normalizar_texto_ocr(texto: str) -> str:
     """
     Normaliza texto OCR para mejorar la extracción:
@@ -45,96 +104,232 @@ def normalizar_texto_ocr(texto: str) -> str:
         return ""
 
     # --- Paso 1: quitar acentos ---
-    texto = unicodedata.normalize('NFKD', texto)
-    texto = texto.encode('ascii', 'ignore').decode('utf-8')
+    texto = quitar_tildes(texto)
 
     # --- Paso 2: mayúsculas ---
     texto = texto.upper()
 
-    # --- Paso 3: reemplazos típicos de OCR ---
-    reemplazos = {
-        "5A": "S.A",
-        "$.A.C": "S.A.C",
-        "S , A": "S.A",
-        "S . A . C": "S.A.C",
-        "S . A": "S.A",
-        "3.A.C": "S.A.C",
-        "SAC.": "S.A.C",
-        "SA.": "S.A.",
-        "E/": "11/",
-        "RETALE": "RETAIL"
-    }
-    for k, v in reemplazos.items():
-        texto = texto.replace(k, v)
+    # --- Paso 3: reemplazos típicos de OCR (una sola pasada) ---
+    texto = _RE_REEMPLAZOS_OCR.sub(lambda m: REEMPLAZOS_OCR[m.group()], texto)
 
     # --- Paso 4: eliminar símbolos no útiles ---
     # Permitimos letras, números y los símbolos útiles . , - / &
-    texto = re.sub(r"[^A-Z0-9\.\,\-\/&\s]", " ", texto)
+    texto = _RE_NO_UTIL.sub(" ", texto)
 
     # --- Paso 5: limpiar espacios alrededor de guiones y slashes ---
-    texto = re.sub(r"\s*-\s*", "-", texto)
-    texto = re.sub(r"\s*/\s*", "/", texto)
+    texto = _RE_SEPARADOR_ESPACIOS.sub(r"\1", texto)
+
+    # --- Paso 6 y 7: en una sola pasada por línea, quitar numeritos iniciales
+    # (ej: '1 TAI LOY' -> 'TAI LOY') y compactar espacios múltiples ---
+    lineas = (linea.strip() for linea in texto.splitlines())
+    texto_limpio = "\n".join(
+        _RE_LIMPIEZA_LINEA.sub(lambda m: "" if m.group(1) else " ", linea)
+        for linea in lineas if linea
+    )
 
-    # --- Paso 6: limpiar numeritos iniciales de línea (ej: '1 TAI LOY' -> 'TAI LOY') ---
-    lineas = []
-    for linea in texto.splitlines():
-        linea = linea.strip()
-        linea = re.sub(r"^\d+\s+", "", linea)  # quita números al inicio
-        if linea:
-            lineas.append(linea)
+    return texto_limpio.strip()
 
-    # --- Paso 7: compactar espacios múltiples ---
-    texto_limpio = "\n".join(re.sub(r"\s{2,}", " ", l) for l in lineas)
+# Saltos de línea que reconoce str.splitlines() ("\r\n" cuenta como uno)
+_RE_SALTO_LINEA = re.compile(r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
 
-    return texto_limpio.strip()
+def primeras_lineas(texto: str, n: int) -> List[str]:
+    """
+    Igual que texto.splitlines()[:n], pero solo recorre hasta el n-ésimo salto
+    de línea en vez de partir el documento completo.
+    """
+    fin = None
+    for i, m in enumerate(_RE_SALTO_LINEA.finditer(texto)):
+        if i == n - 1:
+            fin = m.end()
+            break
+    return (texto if fin is None else texto[:fin]).splitlines()
 
-def normalizar_monto(monto_txt: str) -> Optional[str]:
+def compactar_espacios(texto: str) -> str:
     """
-    Normaliza un monto detectado por OCR a formato '0.00'.
+    Versión compacta del texto OCR (sin bordes y con espacios múltiples colapsados)
+    que comparten los detectores; procesar_datos_ocr la calcula una sola vez.
+    """
+    return _RE_ESPACIOS.sub(" ", texto.strip())
+
+_SIN_SEPARADORES = str.maketrans("", "", ".,")
+
+def unificar_separadores(s: str) -> Optional[str]:
+    """
+    El último separador ("," o ".") es el decimal; los anteriores son de miles
+    y se eliminan en una sola pasada:
+    1.234,56 | 1,234.56 | 1234,56 | 1,234,567,89 | 1.234.567.89 -> 1234.56 / 1234567.89
+    Con ambos separadores, el decimal debe aparecer una sola vez (si no -> None).
+    """
+    dec = max(s.rfind(","), s.rfind("."))
+    if dec < 0:
+        return s
+    if "," in s and "." in s and s.count(s[dec]) > 1:
+        return None
+    return s[:dec].translate(_SIN_SEPARADORES) + "." + s[dec + 1:]
+
+_DOS_DECIMALES = Decimal("0.00")
+
+def monto_a_decimal(monto_txt: str) -> Optional[Decimal]:
+    """
+    Convierte un monto detectado por OCR a Decimal con 2 decimales.
     Maneja:
     - 1,234.56 | 1.234,56 | 1234,56 | 1234.56 | 1.234.567,89 | 1,234,567.89
     - Con o sin símbolos extraños (S/, $, etc.)
-    Retorna str -> '0.00' o None si no se puede parsear.
+    Retorna None si no se puede parsear.
     """
     if not monto_txt:
         return None
 
-    import re
-    from decimal import Decimal, InvalidOperation
-
     # 🔹 Limpiar caracteres no numéricos relevantes
-    s = re.sub(r"[^\d,.\-]", "", monto_txt)
+    s = _RE_NO_MONTO.sub("", monto_txt)
     if not s:
         return None
 
     # 🔹 Determinar separador decimal
-    if "," in s and "." in s:
-        if s.rfind(",") > s.rfind("."):  # 1.234,56 -> 1234.56
-            s = s.replace(".", "").replace(",", ".")
-        else:  # 1,234.56 -> 1234.56
-            s = s.replace(",", "")
-    elif "," in s:
-        if s.count(",") == 1:  # 1234,56 -> 1234.56
-            s = s.replace(",", ".")
-        else:  # 1,234,567,89 -> 1234567.89
-            partes = s.split(",")
-            s = "".join(partes[:-1]) + "." + partes[-1]
-    elif "." in s:
-        partes = s.split(".")
-        if len(partes) > 2:  # 1.234.567.89 -> 1234567.89
-            s = "".join(partes[:-1]) + "." + partes[-1]
+    s = unificar_separadores(s)
+    if s is None:
+        return None
 
     # 🔹 Convertir a Decimal
     try:
-        d = Decimal(s)
-        return f"{d.quantize(Decimal('0.00'))}"
+        return Decimal(s).quantize(_DOS_DECIMALES)
     except (InvalidOperation, ValueError):
         return None
 
+def normalizar_monto(monto_txt: str) -> Optional[str]:
+    """
+    Normaliza un monto detectado por OCR a formato '0.00'.
+    Retorna str -> '0.00' o None si no se puede parsear.
+    """
+    d = monto_a_decimal(monto_txt)
+    return str(d) if d is not None else None
+
+# ========================#
+# CORRECCIÓN DIFUSA OCR   #
+# ========================#
+# Diccionarios de palabras clave por detector (solo palabras de 5+ letras)
+PALABRAS_TOTAL = frozenset({
+    "TOTAL", "IMPORTE", "MONTO", "PAGAR", "FACTURA", "SOLES",
+    "GRAVADA", "GRAVADAS", "DESCUENTO", "RETENCION", "PERIODO",
+})
+PALABRAS_FECHA = frozenset({
+    "FECHA", "EMISION", "ENERO", "FEBRERO", "MARZO", "ABRIL", "JUNIO", "JULIO",
+    "AGOSTO", "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE",
+})
+# Palabras reales a un error de una palabra clave: nunca se corrigen
+PALABRAS_COMUNES_OCR = frozenset({
+    "MARCO", "MARCOS", "JUNTO", "JUNTA", "JUNTAS", "JUNIOR", "JULIA", "ABRIR",
+    "FICHA", "FICHAS", "FLECHA", "MECHA", "MISION", "MONTE", "MONTES",
+})
+
+# Palabras de 5+ caracteres; dentro solo se aceptan los dígitos que el OCR confunde con letras
+_RE_PALABRA_OCR = re.compile(r"\b[A-Z][A-Z015]{3,}[A-Z]\b", flags=re.IGNORECASE)
+# Valores que habilitan la corrección en una línea, según el detector:
+# fechas (numéricas o "5 DE SETIEMBRE 2025") para la fecha, montos sueltos para el total
+_RE_VALOR_FECHA = re.compile(
+    r"\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}"
+    r"|\d{4}[/\-\.]\d{1,2}[/\-\.]\d{1,2}"
+    r"|\b\d{1,2}[\s/\.]+(?:DE\s+)?[A-Z015]{3,}[\s/\.]+(?:DEL?\s+)?\d{2,4}\b",
+    flags=re.IGNORECASE
+)
+# Monto con 2 decimales que no es parte de una fecha (03.06.2025 no cuenta)
+_RE_VALOR_MONTO = re.compile(r"(?<![\d.,/\-])\d{1,3}(?:[.,]\d{3})*[.,]\d{2}(?![.,/\-]?\d)")
+
+def distancia_damerau(a: str, b: str, maximo: int) -> int:
+    """
+    Distancia Damerau-Levenshtein (transposiciones adyacentes) entre `a` y `b`.
+    Corta en cuanto se supera `maximo` y devuelve `maximo + 1`.
+    """
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+
+    previa2 = None
+    previa = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            costo = 0 if ca == cb else 1
+            actual[j] = min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + costo)
+            if previa2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                actual[j] = min(actual[j], previa2[j - 2] + 1)
+        if min(actual) > maximo:
+            return maximo + 1
+        previa2, previa = previa, actual
+    return previa[-1]
+
+@lru_cache(maxsize=None)
+def diccionario_ordenado(diccionario: frozenset) -> Tuple[str, ...]:
+    """Palabras del diccionario en orden alfabético, ordenadas una sola vez por diccionario."""
+    return tuple(sorted(diccionario))
+
+@lru_cache(maxsize=4096)
+def corregir_palabra_ocr(palabra: str, diccionario: frozenset) -> Optional[str]:
+    """
+    Devuelve la palabra del diccionario más cercana a `palabra` o None.
+    Se tolera 1 solo error. No se tocan las palabras comunes (PALABRAS_COMUNES_OCR)
+    ni las que empiezan con una palabra clave (FACTURADO, DESCUENTOS).
+    """
+    if palabra in PALABRAS_COMUNES_OCR or palabra.startswith(diccionario_ordenado(diccionario)):
+        return None
+
+    maximo = 1
+    mejor, mejor_distancia = None, maximo + 1
+    for candidata in diccionario_ordenado(diccionario):
+        distancia = distancia_damerau(palabra, candidata, maximo)
+        if distancia < mejor_distancia:
+            mejor, mejor_distancia = candidata, distancia
+            # La palabra no está en el diccionario: 1 es la menor distancia posible
+            # y en empate gana la primera en orden alfabético
+            if distancia == 1:
+                break
+    return mejor
+
+@lru_cache(maxsize=None)
+def patron_palabras_clave(diccionario: frozenset) -> "re.Pattern":
+    """Regex que encuentra cualquier palabra exacta del diccionario, compilada una vez."""
+    return re.compile(r"\b(?:" + "|".join(diccionario_ordenado(diccionario)) + r")\b", flags=re.IGNORECASE)
+
+def corregir_texto_ocr(texto: str, diccionario: frozenset, valor: "re.Pattern") -> str:
+    """
+    Corrige por similitud las palabras de 5+ caracteres que el OCR leyó mal
+    (ej: 'T0TAL' -> 'TOTAL', 'SETIEMBRE' -> 'SEPTIEMBRE').
+    Solo se tocan las líneas que ya traen una palabra clave exacta o un valor
+    que el detector espera (`valor`: fecha o monto); y nunca las palabras
+    comunes como MARCO, JUNTO o FICHA.
+    """
+    # Lo habitual es que no haya nada que corregir: se descarta sin partir en líneas
+    if not any(corregir_palabra_ocr(p.upper(), diccionario) for p in _RE_PALABRA_OCR.findall(texto)):
+        return texto
+
+    clave = patron_palabras_clave(diccionario)
+
+    def reemplazar(m):
+        corregida = corregir_palabra_ocr(m.group().upper(), diccionario)
+        return corregida or m.group()
+
+    def corregir_linea(linea):
+        if clave.search(linea) or valor.search(linea):
+            return _RE_PALABRA_OCR.sub(reemplazar, linea)
+        return linea
+
+    return "".join(map(corregir_linea, texto.splitlines(keepends=True)))
+
 # ========================#
 # DETECTORES INDIVIDUALES #
 # ========================#
-def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = False) -> str:
+# Patrón robusto: serie (1-3 letras) + opcional Nº + correlativo
+_RE_SERIE_DOCUMENTO = re.compile(
+    r"\b([A-Z]{1,3}\d{0,4})\s*(?:N[°ºO.]?\s*)?[-]?\s*(\d{1,14})\b"
+)
+_RE_SERIE_ALFANUMERICA = re.compile(r"[A-Z]+\d+")
+_RE_DNI = re.compile(r"\b\d{8}\b")
+# Letras que el OCR confunde con dígitos en series y correlativos
+MAPA_DIGITOS_DOCUMENTO = str.maketrans({"O": "0", "I": "1", "L": "1"})
+# Algo que tras .upper() y el mapa anterior sea un dígito (incluye ligaduras ﬁ/ﬂ)
+_RE_DIGITO_OCR = re.compile(r"[\dOIL\ufb01-\ufb04]", flags=re.IGNORECASE)
+
+def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = False,
+                              texto_mayus: Optional[str] = None, ruc: Optional[str] = None) -> str:
     """
     Detecta el número de documento (boleta/factura/nota/ticket) en OCR de PDFs o imágenes.
     Prioriza el número obtenido desde QR si se proporciona.
@@ -145,10 +340,9 @@ def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = F
     - Detecta correlativos largos (hasta 14 dígitos).
     - Prioriza prefijos válidos de comprobantes SUNAT.
     - Devuelve el candidato más confiable.
+    `texto_mayus` permite reutilizar texto.upper() ya calculado y `ruc`
+    el resultado de detectar_ruc(texto).
     """
-    import re
-    from .extraccion import detectar_ruc
-
     # --- Paso 0: usar QR si está disponible ---
     if numero_qr:
         numero_qr_clean = numero_qr.strip()
@@ -162,14 +356,16 @@ def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = F
     if not texto:
         return "ND"
 
-    texto_norm = texto.upper()
-    texto_norm = texto_norm.replace("O", "0").replace("I", "1").replace("L", "1")
+    # Sin dígitos (ni letras que pasen a dígito) no puede haber correlativo
+    if not _RE_DIGITO_OCR.search(texto):
+        return "ND"
+
+    texto_norm = (texto_mayus if texto_mayus is not None else texto.upper()).translate(MAPA_DIGITOS_DOCUMENTO)
     lineas = [l.strip() for l in texto_norm.splitlines() if l.strip()]
 
     # Detectar RUC/DNI para excluirlos
-    ruc_valor = detectar_ruc(texto) or ""
-    dni_matches = re.findall(r"\b\d{8}\b", texto_norm)
-    ignorar = [ruc_valor] + dni_matches
+    ruc_valor = (ruc if ruc is not None else detectar_ruc(texto)) or ""
+    ignorar = {ruc_valor, *_RE_DNI.findall(texto_norm)}
 
     # Prefijos válidos de comprobantes SUNAT
     prefijos_validos = (
@@ -177,26 +373,21 @@ def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = F
         "BE", "BV", "TK"
     )
 
-    # Patrón robusto: serie (1-3 letras) + opcional Nº + correlativo
-    patron = re.compile(
-        r"\b([A-Z]{1,3}\d{0,4})\s*(?:N[°ºO.]?\s*)?[-]?\s*(\d{1,14})\b"
-    )
-
     candidatos = []
     for idx, linea in enumerate(lineas):
-        for match in patron.finditer(linea):
+        for match in _RE_SERIE_DOCUMENTO.finditer(linea):
             serie, correlativo = match.groups()
             numero = f"{serie}-{correlativo}"
 
             # Ignorar coincidencias con RUC/DNI
-            if any(numero.replace("-", "") == x for x in ignorar):
+            if serie + correlativo in ignorar:
                 continue
 
             # Prioridad heurística
             prioridad = 0
             if serie.startswith(prefijos_validos):
                 prioridad += 3
-            if re.match(r"[A-Z]+\d+", serie):
+            if _RE_SERIE_ALFANUMERICA.match(serie):
                 prioridad += 1
             prioridad += len(correlativo) // 4
 
@@ -206,69 +397,61 @@ def detectar_numero_documento(texto: str, numero_qr: str = None, debug: bool = F
         print("Candidatos detectados (OCR):", candidatos)
 
     if candidatos:
-        candidatos.sort(key=lambda x: (-x[1], -len(x[0]), x[2]))
-        return candidatos[0][0]
+        # Solo interesa el mejor: min() recorre una vez en lugar de ordenar
+        # (ante empates devuelve el primero, igual que el sort estable)
+        return min(candidatos, key=lambda x: (-x[1], -len(x[0]), x[2]))[0]
 
     return "ND"
 
-def detectar_tipo_documento(texto: str, debug: bool = False) -> str:
+# 🔹 Patrones flexibles y ampliados por tipo, en orden de prioridad (primero electrónicos)
+PATRONES_TIPO_DOCUMENTO = {
+    "FACTURA DE VENTA ELECTRONICA": [
+        re.compile(r"FACTURA\s*DE\s*VENTA\s*ELECTRONICA"),
+    ],
+    "FACTURA ELECTRONICA": [
+        re.compile(r"FACTURA\s*ELECTRONICA"),
+    ],
+    "FACTURA": [
+        re.compile(r"\bFACTURA\b"),
+        re.compile(r"\bF\-\d{3,}"),  # Ej: F001-1234
+    ],
+    "BOLETA DE VENTA ELECTRONICA": [
+        re.compile(r"BOLETA\s*DE\s*VENTA\s*ELECTRONICA"),
+    ],
+    "BOLETA ELECTRONICA": [
+        re.compile(r"BOLETA\s*ELECTRONICA"),
+    ],
+    "BOLETA": [
+        re.compile(r"\bBOLETA\b"),
+        re.compile(r"\bBOL\b"),
+    ],
+    "HONORARIOS": [
+        re.compile(r"RECIBO\s*POR\s*HONORARIOS"),
+        re.compile(r"HONORARIOS"),
+        re.compile(r"R\.H\."),
+    ],
+}
+
+def detectar_tipo_documento(texto: str, debug: bool = False, texto_norm: Optional[str] = None) -> str:
     """
     Detecta automáticamente el tipo de documento a partir del texto OCR.
     Retorna: 'BOLETA', 'BOLETA ELECTRONICA', 'FACTURA', 'FACTURA ELECTRONICA', 
              'FACTURA DE VENTA ELECTRONICA', 'HONORARIOS' o 'OTROS'.
+    `texto_norm` permite reutilizar compactar_espacios(texto.upper()) ya calculado.
     """
     if not texto:
         return "OTROS"
 
     # 🔹 Normalizar texto: mayúsculas y sin tildes
-    texto_norm = re.sub(r"\s{2,}", " ", texto.strip()).upper()
-    texto_norm = unicodedata.normalize('NFKD', texto_norm).encode('ASCII', 'ignore').decode('ASCII')
-
-    # 🔹 Patrones flexibles y ampliados
-    patrones = {
-        "FACTURA DE VENTA ELECTRONICA": [
-            r"FACTURA\s*DE\s*VENTA\s*ELECTRONICA",
-        ],
-        "FACTURA ELECTRONICA": [
-            r"FACTURA\s*ELECTRONICA",
-        ],
-        "FACTURA": [
-            r"\bFACTURA\b", 
-            r"\bF\-\d{3,}",  # Ej: F001-1234
-        ],
-        "BOLETA DE VENTA ELECTRONICA": [
-            r"BOLETA\s*DE\s*VENTA\s*ELECTRONICA",
-        ],
-        "BOLETA ELECTRONICA": [
-            r"BOLETA\s*ELECTRONICA",
-        ],
-        "BOLETA": [
-            r"\bBOLETA\b",
-            r"\bBOL\b",
-        ],
-        "HONORARIOS": [
-            r"RECIBO\s*POR\s*HONORARIOS",
-            r"HONORARIOS",
-            r"R\.H\."
-        ],
-    }
+    if texto_norm is None:
+        texto_norm = compactar_espacios(texto.upper())
+    texto_norm = quitar_tildes(texto_norm)
 
     tipo_detectado = "OTROS"
 
-    # 🔹 Orden de prioridad (primero electrónicos)
-    orden_prioridad = [
-        "FACTURA DE VENTA ELECTRONICA",
-        "FACTURA ELECTRONICA",
-        "FACTURA",
-        "BOLETA DE VENTA ELECTRONICA",
-        "BOLETA ELECTRONICA",
-        "BOLETA",
-        "HONORARIOS"
-    ]
-
-    for tipo in orden_prioridad:
-        for pat in patrones[tipo]:
-            if re.search(pat, texto_norm):
+    for tipo, patrones in PATRONES_TIPO_DOCUMENTO.items():
+        for pat in patrones:
+            if pat.search(texto_norm):
                 tipo_detectado = tipo
                 break
         if tipo_detectado != "OTROS":
@@ -279,6 +462,39 @@ def detectar_tipo_documento(texto: str, debug: bool = False) -> str:
 
     return tipo_detectado
 
+# 🔹 Meses escritos y patrones de fecha (compilados una sola vez)
+MESES = {
+    "ENE": 1, "ENERO": 1,
+    "FEB": 2, "FEBRERO": 2,
+    "MAR": 3, "MARZO": 3,
+    "ABR": 4, "ABRIL": 4,
+    "MAY": 5, "MAYO": 5,
+    "JUN": 6, "JUNIO": 6,
+    "JUL": 7, "JULIO": 7,
+    "AGO": 8, "AGOSTO": 8,
+    "SEP": 9, "SEPT": 9, "SEPTIEMBRE": 9,
+    "OCT": 10, "OCTUBRE": 10,
+    "NOV": 11, "NOVIEMBRE": 11,
+    "DIC": 12, "DICIEMBRE": 12
+}
+# Una sola alternativa con grupos nombrados: dd/mm/aaaa | aaaa/mm/dd | dd MES aaaa.
+# Va dentro de un lookahead para que un formato no oculte a otro que se solapa
+# (p. ej. "25 DIC 03/06/2025"); los tres formatos nunca empiezan en la misma posición.
+# El día escrito no puede ir pegado a otro dígito ("45 SEPTIEMBRE" no es "5 SEPTIEMBRE").
+_RE_FECHA = re.compile(
+    r'(?=(?P<dmy>\d{1,2}/\d{1,2}/\d{2,4})'
+    r'|(?P<ymd>\d{4}/\d{1,2}/\d{1,2})'
+    r'|(?P<dmon>(?<!\d)(?P<dia>\d{1,2})[\s/\.]+(?P<mes>' + "|".join(MESES.keys()) + r')[\s/\.]+(?P<anio>\d{2,4})))',
+    flags=re.IGNORECASE
+)
+_ORDEN_FECHA = ("dmy", "ymd", "dmon")
+_RE_GUIONES = re.compile(r'[-–—]')
+_RE_PUNTO_DIGITO = re.compile(r'\.(?=\d)')
+_RE_FECHA_EMISION = re.compile(r'FECHA\s*(DE\s*)?EMIS', flags=re.IGNORECASE)
+_RE_DOC_REFERENCIA = re.compile(r'\bF\d{3,}-\d{3,}\b')
+_RE_VENCIMIENTO = re.compile(r'VENCIMEN', flags=re.IGNORECASE)
+_RE_RANGO_FECHAS = re.compile(r'\b\d{1,2}\s*AL\s*\d{1,2}/\d{1,2}/\d{4}\b')
+
 def detectar_fecha(texto: str, qr_data: Optional[str] = None, debug: bool = False) -> Optional[str]:
     """
     Detecta la fecha de emisión en boletas/facturas y normaliza a YYYY-MM-DD.
@@ -300,7 +516,7 @@ def detectar_fecha(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
                     if debug:
                         print("🔹 Fecha desde QR:", f.strftime("%Y-%m-%d"))
                     return f.strftime("%Y-%m-%d")
-                except:
+                except ValueError:
                     continue
             if debug:
                 print("⚠️ Fecha QR no parseada:", qr_fecha)
@@ -308,97 +524,142 @@ def detectar_fecha(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
     if not texto:
         return None
 
+    # Todos los formatos de fecha llevan dígitos: texto sin dígitos se descarta en una pasada
+    if not _RE_DIGITO.search(texto):
+        return None
+
     # --- Normalizar texto ---
-    txt = texto.replace('\r', '\n')
-    txt = re.sub(r'[-–—]', '/', txt)  # convierte "-" en "/"
-    txt = re.sub(r'\.(?=\d)', '/', txt)
-    txt = re.sub(r'\s+', ' ', txt)
+    txt = corregir_texto_ocr(texto, PALABRAS_FECHA, _RE_VALOR_FECHA).replace('\r', '\n')
+    txt = _RE_GUIONES.sub('/', txt)  # convierte "-" en "/"
+    txt = _RE_PUNTO_DIGITO.sub('/', txt)
+    txt = _RE_BLANCOS.sub(' ', txt)
     lineas = [l.strip() for l in txt.splitlines() if l.strip()]
 
-    # --- Patrones básicos ---
-    pat_num = re.compile(r'(\d{1,2}/\d{1,2}/\d{2,4})')
-    pat_iso = re.compile(r'(\d{4}/\d{1,2}/\d{1,2})')
-
-    meses_map = {
-        "ENE": 1, "ENERO": 1,
-        "FEB": 2, "FEBRERO": 2,
-        "MAR": 3, "MARZO": 3,
-        "ABR": 4, "ABRIL": 4,
-        "MAY": 5, "MAYO": 5,
-        "JUN": 6, "JUNIO": 6,
-        "JUL": 7, "JULIO": 7,
-        "AGO": 8, "AGOSTO": 8,
-        "SEP": 9, "SEPT": 9, "SEPTIEMBRE": 9,
-        "OCT": 10, "OCTUBRE": 10,
-        "NOV": 11, "NOVIEMBRE": 11,
-        "DIC": 12, "DICIEMBRE": 12
-    }
-    meses_alt = "|".join(meses_map.keys())
-    pat_text = re.compile(r'(\d{1,2})[\s/\.]+(' + meses_alt + ')[\s/\.]+(\d{2,4})', flags=re.IGNORECASE)
-
     fecha_ref_idx = None
     doc_ref_idx = None
     for i, l in enumerate(lineas):
-        if re.search(r'FECHA\s*(DE\s*)?EMIS', l, flags=re.IGNORECASE):
+        if _RE_FECHA_EMISION.search(l):
             fecha_ref_idx = i
-        if re.search(r'\bF\d{3,}-\d{3,}\b', l):
+        if _RE_DOC_REFERENCIA.search(l):
             doc_ref_idx = i
 
-    fechas_validas = []
-    for idx, linea in enumerate(lineas):
-        if re.search(r'VENCIMEN', linea, flags=re.IGNORECASE):
-            continue
-        if re.search(r'\b\d{1,2}\s*AL\s*\d{1,2}/\d{1,2}/\d{4}\b', linea):
-            continue
-
-        for m in pat_num.finditer(linea):
-            try:
-                partes = m.group(1).split('/')
-                y = int(partes[2]) + (2000 if len(partes[2]) == 2 else 0)
-                d, mo = int(partes[0]), int(partes[1])
-                fechas_validas.append((idx, datetime(y, mo, d)))
-            except:
+    def fechas_candidatas():
+        for idx, linea in enumerate(lineas):
+            # Línea sin dígitos: ningún formato de fecha puede coincidir
+            if not _RE_DIGITO.search(linea):
                 continue
-
-        for m in pat_iso.finditer(linea):
-            try:
-                y, mo, d = [int(x) for x in m.group(1).split('/')]
-                fechas_validas.append((idx, datetime(y, mo, d)))
-            except:
+            if _RE_VENCIMIENTO.search(linea):
                 continue
-
-        for m in pat_text.finditer(linea):
-            try:
-                d = int(m.group(1))
-                mes_txt = m.group(2).upper().replace("0", "O")
-                mes = meses_map.get(mes_txt)
-                y = int(m.group(3)) if len(m.group(3)) == 4 else 2000 + int(m.group(3))
-                if mes:
-                    fechas_validas.append((idx, datetime(y, mes, d)))
-            except:
+            if _RE_RANGO_FECHAS.search(linea):
                 continue
 
+            # Una sola pasada por línea; se agrupan por formato para conservar
+            # el orden numérico → ISO → texto en los empates de prioridad
+            por_formato = {formato: [] for formato in _ORDEN_FECHA}
+            fin_formato = dict.fromkeys(_ORDEN_FECHA, 0)
+            for m in _RE_FECHA.finditer(linea):
+                formato = m.lastgroup
+                # Dentro de un mismo formato las fechas válidas no se solapan;
+                # una coincidencia inválida no tapa a las que empiezan dentro de ella
+                if m.start() < fin_formato[formato]:
+                    continue
+                try:
+                    if formato == "dmy":
+                        partes = m.group("dmy").split('/')
+                        y = int(partes[2]) + (2000 if len(partes[2]) == 2 else 0)
+                        fecha = datetime(y, int(partes[1]), int(partes[0]))
+                    elif formato == "ymd":
+                        y, mo, d = [int(x) for x in m.group("ymd").split('/')]
+                        fecha = datetime(y, mo, d)
+                    else:
+                        mes = MESES.get(m.group("mes").upper().replace("0", "O"))
+                        if not mes:
+                            continue
+                        anio = m.group("anio")
+                        y = int(anio) if len(anio) == 4 else 2000 + int(anio)
+                        fecha = datetime(y, mes, int(m.group("dia")))
+                except ValueError:
+                    continue
+                fin_formato[formato] = m.end(formato)
+                por_formato[formato].append(fecha)
+
+            for formato in _ORDEN_FECHA:
+                for fecha in por_formato[formato]:
+                    yield idx, fecha
+
+    # 🔹 Prioridad de una candidata según su línea (menor = mejor)
+    def prioridad(i):
+        if fecha_ref_idx is not None:
+            return 0 if i == fecha_ref_idx else 1
+        if doc_ref_idx is not None:
+            return abs(i - doc_ref_idx), i
+        return 0
+
+    # 🔹 Se conserva solo la mejor candidata (y la mejor dentro de los últimos 5 años)
+    hoy = datetime.now()
+    desde, hasta = hoy - timedelta(days=5*365), hoy + timedelta(days=1)
+    # Prioridad imposible de mejorar: la línea de "FECHA EMISIÓN", la del Nº de documento,
+    # o cualquiera si no hay referencia. Una fecha válida ahí ya es la respuesta.
+    clave_minima = prioridad(
+        fecha_ref_idx if fecha_ref_idx is not None
+        else doc_ref_idx if doc_ref_idx is not None
+        else 0
+    )
+    mejor = mejor_en_rango = None
+    candidatas_debug = []
+    for idx, fecha in fechas_candidatas():
+        clave = prioridad(idx)
+        if mejor is None or clave < mejor[0]:
+            mejor = (clave, fecha)
+        if debug:
+            candidatas_debug.append((idx, fecha.strftime("%Y-%m-%d")))
+        if desde <= fecha <= hasta and (mejor_en_rango is None or clave < mejor_en_rango[0]):
+            mejor_en_rango = (clave, fecha)
+            if clave == clave_minima:
+                break
+
     if debug:
-        print("Fechas candidatas:", [(i, f.strftime("%Y-%m-%d")) for i, f in fechas_validas])
+        print("Fechas candidatas:", candidatas_debug)
 
-    if not fechas_validas:
+    elegida = mejor_en_rango or mejor
+    if elegida is None:
         return None
 
-    hoy = datetime.now()
-    fechas_filtradas = [(i, f) for i, f in fechas_validas if (hoy - timedelta(days=5*365)) <= f <= (hoy + timedelta(days=1))]
-    if not fechas_filtradas:
-        fechas_filtradas = fechas_validas
-
-    if fecha_ref_idx is not None:
-        for i, f in fechas_filtradas:
-            if i == fecha_ref_idx:
-                return f.strftime("%Y-%m-%d")
-    elif doc_ref_idx is not None:
-        fechas_filtradas.sort(key=lambda x: (abs(x[0] - doc_ref_idx), x[0]))
-    else:
-        fechas_filtradas.sort(key=lambda x: x[0])
-
-    return fechas_filtradas[0][1].strftime("%Y-%m-%d")
+    return elegida[1].strftime("%Y-%m-%d")
+
+# 🔹 RUCs que no queremos capturar (ej: el RUC de la propia empresa)
+RUC_EXCLUIDOS = frozenset({"20508558997"})
+PREFIJOS_RUC = frozenset({"10", "15", "16", "17", "20"})
+PATRONES_RUC = ("RUC", "RU0", "RUO", "RUG", "PUC")
+
+# 🔹 Mapeo de errores frecuentes OCR
+MAPA_ERRORES_RUC = str.maketrans({
+    "C": "0", "D": "0", "O": "0", "Q": "0",
+    "I": "1", "L": "1",
+    "S": "5",
+    "B": "8",
+    "G": "6",
+    "Z": "2"
+})
+_RE_RUC_OCR = re.compile(r"\b[\dA-Z]{11}\b")
+# Cualquiera de PATRONES_RUC en una sola búsqueda
+_RE_CLAVE_RUC = re.compile("|".join(map(re.escape, PATRONES_RUC)))
+_RE_SEPARADORES_RUC = re.compile(r"[\s:.]")
+_RE_RUC_PEGADO = re.compile(r"(RUC)(\d{11})")
+_RE_NO_ALFANUMERICO = re.compile(r"[^\dA-Z]")
+
+def es_ruc_valido(ruc: str) -> bool:
+    return ruc not in RUC_EXCLUIDOS and ruc[:2] in PREFIJOS_RUC and len(ruc) == 11
+
+def primer_ruc_valido(linea: str) -> Optional[str]:
+    """
+    Devuelve el primer RUC válido de la línea (ya corregido) sin recorrer el resto.
+    """
+    for m in _RE_RUC_OCR.finditer(linea):
+        ruc = _RE_NO_DIGITO.sub("", m.group().translate(MAPA_ERRORES_RUC))
+        if es_ruc_valido(ruc):
+            return ruc
+    return None
 
 def detectar_ruc(texto: str, qr_data: Optional[str] = None, debug: bool = False) -> Optional[str]:
     """
@@ -412,20 +673,6 @@ def detectar_ruc(texto: str, qr_data: Optional[str] = None, debug: bool = False)
       - Excluye RUCs no deseados.
     """
 
-    import re
-
-    RUC_EXCLUIDOS = {"20508558997"}  # ejemplo: RUC que no queremos capturar
-
-    # 🔹 Mapeo de errores frecuentes OCR
-    mapa_errores = str.maketrans({
-        "C": "0", "D": "0", "O": "0", "Q": "0",
-        "I": "1", "L": "1",
-        "S": "5",
-        "B": "8",
-        "G": "6",
-        "Z": "2"
-    })
-
     # ==========================================================
     # 1. Intentar extraer desde QR
     # ==========================================================
@@ -433,10 +680,8 @@ def detectar_ruc(texto: str, qr_data: Optional[str] = None, debug: bool = False)
         try:
             campos = qr_data.split("|")
             if campos:
-                qr_ruc = re.sub(r"[^\d]", "", campos[0].strip())  # solo números
-                if (qr_ruc not in RUC_EXCLUIDOS 
-                    and qr_ruc[:2] in {"10","15","16","17","20"} 
-                    and len(qr_ruc) == 11):
+                qr_ruc = _RE_NO_DIGITO.sub("", campos[0].strip())  # solo números
+                if es_ruc_valido(qr_ruc):
                     if debug:
                         print("✅ RUC detectado desde QR:", qr_ruc)
                     return qr_ruc
@@ -446,152 +691,156 @@ def detectar_ruc(texto: str, qr_data: Optional[str] = None, debug: bool = False)
 
     # ==========================================================
     # 2. Intentar extraer desde OCR (primeras 10 líneas)
+    # 3. Fallback: cualquier número de 11 dígitos válido, guardado
+    #    en la misma pasada y usado solo si ninguna línea dice "RUC"
     # ==========================================================
-    texto = (texto or "").upper()
-    lineas = texto.splitlines()[:10]
-    patrones_ruc = ["RUC", "RU0", "RUO", "RUG", "PUC"]
-
-    posibles_ruc = []
-    for linea in lineas:
-        linea_limpia = re.sub(r"[\s:.]", "", linea)
-        linea_limpia = re.sub(r"(RUC)(\d{11})", r"\1 \2", linea_limpia)
-
-        if any(p in linea_limpia for p in patrones_ruc):
-            rucs = re.findall(r"\b[\dA-Z]{11}\b", linea_limpia)
-            for r in rucs:
-                r_norm = r.translate(mapa_errores)
-                r_norm = re.sub(r"[^\d]", "", r_norm)
-                if (r_norm not in RUC_EXCLUIDOS 
-                    and r_norm[:2] in {"10","15","16","17","20"} 
-                    and len(r_norm) == 11):
-                    posibles_ruc.append(r_norm)
-
-    if posibles_ruc:
-        if debug:
-            print("✅ RUC detectado desde OCR:", posibles_ruc[0])
-        return posibles_ruc[0]
+    ruc_fallback = None
 
-    # ==========================================================
-    # 3. Fallback: buscar cualquier número de 11 dígitos válido
-    # ==========================================================
-    for linea in lineas:
-        linea_limpia = re.sub(r"[^\dA-Z]", "", linea)
-        rucs = re.findall(r"\b[\dA-Z]{11}\b", linea_limpia)
-        for r in rucs:
-            r_norm = r.translate(mapa_errores)
-            r_norm = re.sub(r"[^\d]", "", r_norm)
-            if (r_norm not in RUC_EXCLUIDOS 
-                and r_norm[:2] in {"10","15","16","17","20"} 
-                and len(r_norm) == 11):
+    for linea in primeras_lineas(texto or "", 10):
+        linea = linea.upper()
+        linea_limpia = _RE_SEPARADORES_RUC.sub("", linea)
+        linea_limpia = _RE_RUC_PEGADO.sub(r"\1 \2", linea_limpia)
+
+        if _RE_CLAVE_RUC.search(linea_limpia):
+            ruc = primer_ruc_valido(linea_limpia)
+            if ruc:
                 if debug:
-                    print("✅ RUC fallback detectado:", r_norm)
-                return r_norm
+                    print("✅ RUC detectado desde OCR:", ruc)
+                return ruc
+
+        if ruc_fallback is None:
+            ruc_fallback = primer_ruc_valido(_RE_NO_ALFANUMERICO.sub("", linea))
+
+    if ruc_fallback:
+        if debug:
+            print("✅ RUC fallback detectado:", ruc_fallback)
+        return ruc_fallback
 
     if debug:
         print("❌ No se detectó RUC válido")
     return None
 
-def detectar_razon_social(texto: str, ruc: Optional[str] = None, debug: bool = False) -> str:
+def razon_social_desde_db(ruc: str, debug: bool = False) -> Optional[str]:
+    """
+    Busca la razón social registrada para un RUC.
+    Retorna None si no existe o si la consulta falla.
+    """
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT razon_social FROM boleta_api_razonsocial WHERE ruc = %s LIMIT 1;",
+                (ruc,)
+            )
+            row = cur.fetchone()
+            if row:
+                resultado_db = row[0].strip()
+                if debug:
+                    print("🔹 Razón Social desde DB:", resultado_db)
+                return resultado_db
+    except Exception as e:
+        logger.warning("Error al consultar DB: %s", e)
+    return None
+
+# 🔹 Reemplazos OCR de siglas societarias
+REEMPLAZOS_RAZON_SOCIAL = [
+    (re.compile(r"5[,\.]?\s*A", flags=re.IGNORECASE), "S.A."),
+    (re.compile(r"\bS[\s\./,-]*A[\s\./,-]*C\b", flags=re.IGNORECASE), "S.A.C"),
+    (re.compile(r"\bS[\s\./,-]*A\b", flags=re.IGNORECASE), "S.A."),
+    (re.compile(r"\bE[\s\./,-]*I[\s\./,-]*R[\s\./,-]*L\b", flags=re.IGNORECASE), "E.I.R.L"),
+]
+_RE_RUIDO_RAZON_SOCIAL = re.compile(
+    r"\b(FACTURA|BOLETA|ELECTRONICA|ELECTRÓNICA|RAZ\.?SOCIAL:?)\b",
+    flags=re.IGNORECASE
+)
+
+# --- BLOQUEOS ---
+_RE_EXCLUSION_RAZON_SOCIAL = re.compile(
+    r"^(RUC|R\.U\.C|CLIENTE|DIRECCION|OFICINA|CAL|JR|AV|PSJE|MZA|LOTE|ASC|TELF|CIUDAD|PROV)",
+    flags=re.IGNORECASE
+)
+_RE_EMPRESA_PROPIA = re.compile(
+    r"V\s*&?\s*C\s+CORPORATION(\s+S\.?A\.?C\.?| SOCIEDAD ANONIMA CERRADA)?",
+    flags=re.IGNORECASE
+)
+_RE_FECHA_EN_LINEA = re.compile(
+    r"\b(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}|\d{4}[/\-\.]\d{1,2}[/\-\.]\d{1,2})\b"
+)
+_RE_FINALES_RUIDOSOS = re.compile(
+    r"(REPRESENTACION IMPRESA|PARA VER EL DOCUMENTO|HTTPS?:|WWW\.)",
+    flags=re.IGNORECASE
+)
+_RE_CORTE_RUC = re.compile(r"R\.?\s*U\.?\s*C.*")
+_RE_CORTE_DOCUMENTO = re.compile(r"\b[FBE]\d{3,}-\d+")
+_RE_ARTICULO_INICIAL = re.compile(r"^(ES|LA|EL|LOS|LAS)\s+")
+_RE_RUC_FINAL = re.compile(r"[\s,:;\-]*(R\.?\s*U\.?\s*C.*)+$")
+
+TERMINACIONES_EMPRESA = [
+    r"S\.?A\.?C\.?$", r"S\.?A\.?$", r"E\.?I\.?R\.?L\.?$",
+    r"SOCIEDAD ANONIMA CERRADA$", r"SOCIEDAD ANONIMA$",
+    r"EMPRESA INDIVIDUAL DE RESPONSABILIDAD LIMITADA$",
+    r"RESPONSABILIDAD LIMITADA$",
+    r"UNIVERSIDAD$", r"INSTITUTO$", r"COLEGIO$", r"CENTRO$", r"ACADEMIA$",
+]
+# Una sola búsqueda equivale a probar cada terminación por separado
+_RE_TERMINACION_EMPRESA = re.compile("|".join(TERMINACIONES_EMPRESA))
+_RE_SIGLAS_EMPRESA = re.compile(r"S\.A\.C|S\.A\.|E\.I\.R\.L")
+PALABRAS_EMPRESA = ("CORPORATION", "IMPORTACIONES", "CONSTRUCTORA", "CONSULTING", "INDUSTRIAL")
+
+def detectar_razon_social(texto: str, ruc: Optional[str] = None, debug: bool = False,
+                          consultar_db: bool = True, texto_norm: Optional[str] = None) -> str:
     if not texto:
         return ""
 
-    import re
-
-    # 🔹 Normalizar texto OCR
-    texto_norm = re.sub(r"\s{2,}", " ", texto.strip()).upper()
+    # 🔹 Normalizar texto OCR (solo se pasan a mayúsculas las líneas candidatas)
+    if texto_norm is None:
+        texto_norm = compactar_espacios(texto)
 
     # 🔹 Consultar DB primero
-    if ruc:
-        try:
-            with get_connection() as conn, conn.cursor() as cur:
-                cur.execute(
-                    "SELECT razon_social FROM boleta_api_razonsocial WHERE ruc = %s LIMIT 1;",
-                    (ruc,)
-                )
-                row = cur.fetchone()
-                if row:
-                    resultado_db = row[0].strip()
-                    if debug:
-                        print("🔹 Razón Social desde DB:", resultado_db)
-                    return resultado_db
-        except Exception as e:
-            print("Error al consultar DB:", e)
+    if ruc and consultar_db:
+        resultado_db = razon_social_desde_db(ruc, debug=debug)
+        if resultado_db is not None:
+            return resultado_db
 
     # 🔹 Reemplazos OCR
-    reemplazos_regex = {
-        r"5[,\.]?\s*A": "S.A.",
-        r"\bS[\s\./,-]*A[\s\./,-]*C\b": "S.A.C",
-        r"\bS[\s\./,-]*A\b": "S.A.",
-        r"\bE[\s\./,-]*I[\s\./,-]*R[\s\./,-]*L\b": "E.I.R.L",
-    }
-    for patron, reemplazo in reemplazos_regex.items():
-        texto_norm = re.sub(patron, reemplazo, texto_norm)
+    for patron, reemplazo in REEMPLAZOS_RAZON_SOCIAL:
+        texto_norm = patron.sub(reemplazo, texto_norm)
 
     # 🔹 Quitar ruido
-    texto_norm = re.sub(
-        r"\b(FACTURA|BOLETA|ELECTRONICA|ELECTRÓNICA|RAZ\.?SOCIAL:?)\b",
-        "", texto_norm, flags=re.IGNORECASE
-    )
+    texto_norm = _RE_RUIDO_RAZON_SOCIAL.sub("", texto_norm)
 
     # 🔹 Tomar solo las primeras 10 líneas
-    lineas = [l.strip(" ,.-") for l in texto_norm.splitlines() if l.strip()][:10]
-
-    # --- BLOQUEOS ---
-    patron_exclusion = re.compile(
-        r"^(RUC|R\.U\.C|CLIENTE|DIRECCION|OFICINA|CAL|JR|AV|PSJE|MZA|LOTE|ASC|TELF|CIUDAD|PROV)",
-        flags=re.IGNORECASE
-    )
-    patron_empresa = re.compile(
-        r"V\s*&?\s*C\s+CORPORATION(\s+S\.?A\.?C\.?| SOCIEDAD ANONIMA CERRADA)?",
-        flags=re.IGNORECASE
-    )
-    patron_fecha = re.compile(
-        r"\b(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}|\d{4}[/\-\.]\d{1,2}[/\-\.]\d{1,2})\b"
-    )
-    patron_finales_ruidosos = re.compile(
-        r"(REPRESENTACION IMPRESA|PARA VER EL DOCUMENTO|HTTPS?:|WWW\.)",
-        flags=re.IGNORECASE
-    )
+    lineas = [l.strip(" ,.-").upper() for l in texto_norm.splitlines() if l.strip()][:10]
 
     nuevas_lineas = []
     for l in lineas:
-        l = re.split(r"R\.?\s*U\.?\s*C.*", l)[0].strip()
-        l = re.split(r"\b[FBE]\d{3,}-\d+", l)[0].strip()
+        l = _RE_CORTE_RUC.split(l, 1)[0].strip()
+        l = _RE_CORTE_DOCUMENTO.split(l, 1)[0].strip()
         if ruc:
             l = l.replace(ruc, "").strip()
-        l = re.sub(r"^(ES|LA|EL|LOS|LAS)\s+", "", l)
+        l = _RE_ARTICULO_INICIAL.sub("", l)
 
         if not l:
             continue
-        if patron_exclusion.match(l):
+        if _RE_EXCLUSION_RAZON_SOCIAL.match(l):
             continue
-        if patron_empresa.search(l):
+        if _RE_EMPRESA_PROPIA.search(l):
             continue
-        if patron_fecha.search(l):
+        if _RE_FECHA_EN_LINEA.search(l):
             continue
-        if patron_finales_ruidosos.search(l):
+        if _RE_FINALES_RUIDOSOS.search(l):
             continue
 
         nuevas_lineas.append(l)
 
     lineas_validas = nuevas_lineas
 
-    terminaciones = [
-        r"S\.?A\.?C\.?$", r"S\.?A\.?$", r"E\.?I\.?R\.?L\.?$",
-        r"SOCIEDAD ANONIMA CERRADA$", r"SOCIEDAD ANONIMA$",
-        r"EMPRESA INDIVIDUAL DE RESPONSABILIDAD LIMITADA$",
-        r"RESPONSABILIDAD LIMITADA$",
-        r"UNIVERSIDAD$", r"INSTITUTO$", r"COLEGIO$", r"CENTRO$", r"ACADEMIA$",
-    ]
-
     def puntuar(linea: str) -> int:
         score = 0
-        if any(re.search(term, linea) for term in terminaciones):
+        if _RE_TERMINACION_EMPRESA.search(linea):
             score += 5
-        if re.search(r"S\.A\.C|S\.A\.|E\.I\.R\.L", linea):
+        if _RE_SIGLAS_EMPRESA.search(linea):
             score += 3
-        palabras_empresa = ["CORPORATION", "IMPORTACIONES", "CONSTRUCTORA", "CONSULTING", "INDUSTRIAL"]
-        if any(p in linea for p in palabras_empresa):
+        if any(p in linea for p in PALABRAS_EMPRESA):
             score += 2
         if len(linea.split()) >= 2:
             score += 1
@@ -615,15 +864,15 @@ def detectar_razon_social(texto: str, ruc: Optional[str] = None, debug: bool = F
         for window in range(2, 5):
             for i in range(len(lineas_validas) - window + 1):
                 combinado = " ".join(lineas_validas[i:i+window])
-                if any(re.search(term, combinado) for term in terminaciones):
-                    razon_social = re.sub(r"\s+", " ", combinado).strip()
+                if _RE_TERMINACION_EMPRESA.search(combinado):
+                    razon_social = _RE_BLANCOS.sub(" ", combinado).strip()
                     break
             if razon_social:
                 break
 
     # 🔹 Limpiar restos
     if razon_social:
-        razon_social = re.sub(r"[\s,:;\-]*(R\.?\s*U\.?\s*C.*)+$", "", razon_social).strip()
+        razon_social = _RE_RUC_FINAL.sub("", razon_social).strip()
         if ruc:
             razon_social = razon_social.replace(ruc, "").strip()
 
@@ -635,6 +884,20 @@ def detectar_razon_social(texto: str, ruc: Optional[str] = None, debug: bool = F
 
     return resultado
 
+# 🔹 Palabras clave del total y líneas a descartar
+CLAVES_TOTAL = ("TOTAL A PAGAR", "IMPORTE TOTAL", "MONTO TOTAL", "TOTAL FACTURA", "TOTAL")
+IGNORAR_MONTO = ("GRAVADA", "IGV", "DESCUENTO", "RETENCION", "PERIODO", "OP. GRAVADAS")
+
+# Todas las claves contienen "TOTAL": basta esa subcadena (sin regex) para
+# descartar las líneas que no son candidatas a total
+CLAVE_COMUN_TOTAL = "TOTAL"
+_RE_MONTO = re.compile(r"\d{1,3}(?:[.,]\d{3})*[.,]\d{2}")
+_RE_IGNORAR_MONTO = re.compile("|".join(map(re.escape, IGNORAR_MONTO)), flags=re.IGNORECASE)
+_RE_MONTO_LETRAS = re.compile(r"SOLES|/100", flags=re.IGNORECASE)
+# Variantes OCR del símbolo de soles: "S . /", "S-/", "S.", "S /"
+_RE_SIMBOLO_SOLES = re.compile(r"S(?: \. /|-/|\.| /)", flags=re.IGNORECASE)
+_RE_CENTAVOS = re.compile(r"(\d{1,2})/100")
+
 def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = False) -> str:
     """
     Detecta el total a pagar en boletas/facturas.
@@ -651,7 +914,7 @@ def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
                 total_decimal = Decimal(qr_total.replace(",", ""))
                 if debug:
                     print("🔹 Total desde QR:", total_decimal)
-                return f"{total_decimal.quantize(Decimal('0.00'))}"
+                return str(total_decimal.quantize(_DOS_DECIMALES))
             except Exception as e:
                 if debug:
                     print(f"⚠️ Total QR no parseado: {qr_total} ({e})")
@@ -660,61 +923,30 @@ def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
     if not texto:
         return "0.00"
 
-    # 🔹 Normalizar texto
-    texto_norm = (
-        texto.upper()
-        .replace("S . /", "S/")
-        .replace("S-/", "S/")
-        .replace("S.", "S/")
-        .replace("S /", "S/")
-    )
-    lineas = [l.strip() for l in texto_norm.splitlines() if l.strip()]
+    # 🔹 Normalizar texto (los patrones ignoran mayúsculas, no se copia en .upper())
+    texto_norm = _RE_SIMBOLO_SOLES.sub("S/", texto)
+    texto_norm = corregir_texto_ocr(texto_norm, PALABRAS_TOTAL, _RE_VALOR_MONTO)
 
-    # 🔹 Palabras clave
-    claves_total = ["TOTAL A PAGAR", "IMPORTE TOTAL", "MONTO TOTAL", "TOTAL FACTURA", "TOTAL"]
-    ignorar_monto = ["GRAVADA", "IGV", "DESCUENTO", "RETENCION", "PERIODO", "OP. GRAVADAS"]
-
-    # 🔹 Normalización robusta de montos OCR
-    def normalizar_monto(monto_txt: str) -> Optional[Decimal]:
-        if not monto_txt:
-            return None
-        s = re.sub(r"[^\d,.\-]", "", monto_txt)
-        if not s:
-            return None
-
-        if "," in s and "." in s:
-            if s.rfind(",") > s.rfind("."):
-                s = s.replace(".", "")
-                s = s.replace(",", ".")
-            else:
-                s = s.replace(",", "")
-        elif "," in s:
-            if s.count(",") == 1:
-                s = s.replace(",", ".")
-            else:
-                partes = s.split(",")
-                s = "".join(partes[:-1]) + "." + partes[-1]
-        elif "." in s:
-            partes = s.split(".")
-            if len(partes) > 2:
-                s = "".join(partes[:-1]) + "." + partes[-1]
+    # 🔹 Mayor monto válido de un iterable de textos (sin acumular listas);
+    # monto_a_decimal ya lo deja con 2 decimales
+    def mayor_monto(montos_txt) -> Optional[Decimal]:
+        return max(
+            (n for n in map(monto_a_decimal, montos_txt) if n is not None),
+            default=None,
+        )
 
-        try:
-            return Decimal(s).quantize(Decimal("0.00"))
-        except:
-            return None
-
-    # 1️⃣ Montos con palabras clave
-    montos_prioritarios = []
-    for linea in lineas:
-        if any(c in linea for c in claves_total) and not any(i in linea for i in ignorar_monto):
-            montos = re.findall(r"\d{1,3}(?:[.,]\d{3})*[.,]\d{2}", linea)
-            for m in montos:
-                n = normalizar_monto(m)
-                if n is not None:
-                    montos_prioritarios.append(n)
-    if montos_prioritarios:
-        return f"{max(montos_prioritarios).quantize(Decimal('0.00'))}"
+    lineas = [l.strip() for l in texto_norm.splitlines() if l.strip()]
+
+    # 1️⃣ Montos con palabras clave (regex de montos solo en líneas con "TOTAL")
+    mejor = mayor_monto(
+        m.group()
+        for linea in lineas
+        if CLAVE_COMUN_TOTAL in linea.upper() and not _RE_IGNORAR_MONTO.search(linea)
+        # Las fechas de la línea se quitan antes: "03.06.2025" no es un monto
+        for m in _RE_MONTO.finditer(_RE_FECHA_EN_LINEA.sub(" ", linea))
+    )
+    if mejor is not None:
+        return str(mejor)
 
     # 2️⃣ Montos en letras
     UNIDADES = {"CERO":0, "UNO":1, "DOS":2, "TRES":3, "CUATRO":4, "CINCO":5,
@@ -730,10 +962,10 @@ def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
     def letras_a_numero(texto_letras: str) -> Optional[Decimal]:
         texto_letras = texto_letras.upper().replace("-", " ")
         decimales = 0
-        match = re.search(r"(\d{1,2})/100", texto_letras)
+        match = _RE_CENTAVOS.search(texto_letras)
         if match:
             decimales = int(match.group(1))
-            texto_letras = re.sub(r"\d{1,2}/100", "", texto_letras)
+            texto_letras = _RE_CENTAVOS.sub("", texto_letras)
 
         total = 0
         parcial = 0
@@ -752,27 +984,29 @@ def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
         total += decimales/100
         return Decimal(str(round(total,2))) if total>0 else None
 
-    montos_letras = []
-    for linea in lineas:
-        if "SOLES" in linea or "/100" in linea:
-            n = letras_a_numero(linea)
-            if n is not None:
-                montos_letras.append(n)
-    if montos_letras:
-        return f"{max(montos_letras).quantize(Decimal('0.00'))}"
+    mejor = max(
+        (
+            n for n in (
+                letras_a_numero(linea)
+                for linea in lineas
+                if _RE_MONTO_LETRAS.search(linea)
+            )
+            if n is not None
+        ),
+        default=None,
+    )
+    if mejor is not None:
+        return str(mejor.quantize(_DOS_DECIMALES))
 
     # 3️⃣ Todos los montos descartando palabras ignoradas
-    montos_texto = []
-    for linea in lineas:
-        if any(i in linea for i in ignorar_monto):
-            continue
-        decs = re.findall(r"\d{1,3}(?:[.,]\d{3})*[.,]\d{2}", linea)
-        for d in decs:
-            n = normalizar_monto(d)
-            if n is not None:
-                montos_texto.append(n)
-    if montos_texto:
-        return f"{max(montos_texto).quantize(Decimal('0.00'))}"
+    mejor = mayor_monto(
+        m.group()
+        for linea in lineas
+        if not _RE_IGNORAR_MONTO.search(linea)
+        for m in _RE_MONTO.finditer(linea)
+    )
+    if mejor is not None:
+        return str(mejor)
 
     return "0.00"
 
@@ -780,9 +1014,30 @@ def detectar_total(texto: str, qr_data: Optional[str] = None, debug: bool = Fals
 # PROCESAMIENTO GENERAL OCR #
 # ==========================#
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) -> Dict[str, Optional[str]]:
+# Tiempo (segundos) que se conservan los campos detectados por hash del texto OCR
+CACHE_OCR_TIMEOUT = 60 * 60
+
+# Palabras que indican que la capa de texto de un PDF ya sirve sin OCR
+PALABRAS_TEXTO_NATIVO = ("RUC", "TOTAL", "FECHA", "IMPORTE")
+
+def extraer_textos_pdf(origen) -> List[str]:
+    """
+    Texto nativo por página de un PDF (ruta o file-like) usando pdfplumber.
+    """
+    with pdfplumber.open(origen) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+def tiene_texto_util(textos: Iterable[str]) -> bool:
+    # Página por página: se corta en la primera que tenga una palabra clave,
+    # sin unir ni pasar a mayúsculas el documento completo
+    return any(
+        palabra in texto
+        for texto in map(str.upper, textos)
+        for palabra in PALABRAS_TEXTO_NATIVO
+    )
+
+def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = False) -> Dict[str, Optional[str]]:
     """
     Procesa texto OCR de un documento (boleta/factura) optimizado:
     - Si recibe `str` con texto → lo usa directamente.
@@ -796,7 +1051,7 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
     if debug:
         print(msg_inicio)
     else:
-        logger.info(msg_inicio)
+        logger.debug(msg_inicio)
 
     texto = None
     qr_datos = {"ruc_emisor": None, "numero_documento": None, "fecha_emision": None, "total": None}
@@ -809,8 +1064,6 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
         img_cv = corregir_perspectiva(img_cv, debug=debug)
         img_opt = Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
 
-        from pyzbar import pyzbar
-        import numpy as np
         qr_codes = pyzbar.decode(np.array(img_opt))
         if qr_codes:
             contenido = qr_codes[0].data.decode("utf-8", errors="ignore").strip()
@@ -819,7 +1072,7 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
                 print(contenido)
                 print("=" * 60 + "\n")
             else:
-                logger.info(f"[QR] Texto QR crudo detectado (IMAGEN): {contenido}")
+                logger.info("[QR] Texto QR crudo detectado (IMAGEN): %s", contenido)
 
             partes = contenido.split("|")
             if len(partes) >= 4:
@@ -853,61 +1106,80 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
         img_sharp = img_eq.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
         img_denoised = img_sharp.filter(ImageFilter.MedianFilter(size=3))
         img_bin = img_denoised.point(lambda x: 0 if x < 150 else 255, "1")
-        texto = pytesseract.image_to_string(img_bin, lang="spa")
+        texto = ocr_paginas([img_bin], lang="spa")[0]
 
     # --- PDF ---
     elif isinstance(entrada, str) and entrada.lower().endswith(".pdf") and os.path.exists(entrada):
-        paginas = procesar_pdf(entrada, dpi=140)
-        def procesar_pagina(pag):
-            txt = pag.extract_text() if hasattr(pag, "extract_text") else ""
-            txt = (txt or "").strip()
-            try:
-                from pyzbar import pyzbar
-                import numpy as np
-                img_pag = pag.to_image(resolution=100).original if hasattr(pag, "to_image") else None
-                if isinstance(img_pag, Image.Image):
-                    qr_codes = pyzbar.decode(np.array(img_pag))
-                    if qr_codes:
-                        contenido = qr_codes[0].data.decode("utf-8", errors="ignore").strip()
-                        if debug:
-                            print("\n📡 TEXTO QR CRUDO DETECTADO (PDF):")
-                            print(contenido)
-                            print("=" * 60 + "\n")
-                        else:
-                            logger.info(f"[QR] Texto QR crudo detectado (PDF): {contenido}")
-                        partes = contenido.split("|")
-                        if len(partes) >= 4:
-                            serie = partes[2].strip()
-                            correlativo = partes[3].strip().zfill(8)
-                            qr_datos["numero_documento"] = f"{serie}-{correlativo}" if serie else None
-                        if len(partes) >= 7:
-                            qr_datos["ruc_emisor"] = partes[0].strip() or None
-                            qr_datos["total"] = partes[5].strip() or None
-                            qr_datos["fecha_emision"] = partes[6].strip() or None
-                        if debug:
-                            print(f"[QR] Datos capturados (PDF) -> RUC: {qr_datos['ruc_emisor']}, "
-                                  f"NUM_DOC: {qr_datos['numero_documento']}, "
-                                  f"Total: {qr_datos['total']}, Fecha: {qr_datos['fecha_emision']}")
-            except Exception as e:
-                logger.warning(f"[QR] No se pudo extraer QR de página PDF: {e}")
-
-            if not any(k in txt.upper() for k in ["RUC", "TOTAL", "FECHA"]):
-                img_pag = pag.to_image(resolution=100).original if hasattr(pag, "to_image") else pag
-                if isinstance(img_pag, Image.Image):
-                    img_pag = asegurar_orientacion_vertical(img_pag, debug=debug)
-                    if img_pag.width > 1200 or img_pag.height < 1000:
-                        h = max(int(img_pag.height * 1200 / img_pag.width), 1000)
-                        w = int(img_pag.width * h / img_pag.height)
-                        img_pag = img_pag.resize((w, h), Image.Resampling.LANCZOS)
-                    img_gray = img_pag.convert("L")
-                    img_bin = img_gray.point(lambda x: 0 if x < 150 else 255, "1")
-                    txt = pytesseract.image_to_string(img_bin, lang="spa")
-            return txt
-
-        max_threads = min(len(paginas), multiprocessing.cpu_count())
-        with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            textos = list(executor.map(procesar_pagina, paginas))
-        texto = "\n".join(textos)
+        # PDF nativo (con capa de texto): se usa directo, sin rasterizar ni OCR
+        try:
+            textos_nativos = extraer_textos_pdf(entrada)
+        except Exception as e:
+            logger.warning("[PDF] No se pudo leer texto nativo de %s: %s", entrada, e)
+            textos_nativos = []
+
+        if tiene_texto_util(textos_nativos):
+            texto = "\n".join(textos_nativos)
+        else:
+            paginas = procesar_pdf(entrada, dpi=140)
+            def procesar_pagina(pag):
+                txt = pag.extract_text() if hasattr(pag, "extract_text") else ""
+                txt = (txt or "").strip()
+                # La página se renderiza una sola vez: la misma imagen sirve para QR y OCR
+                img_render = None
+                try:
+                    img_pag = img_render = pag.to_image(resolution=100).original if hasattr(pag, "to_image") else None
+                    if isinstance(img_pag, Image.Image):
+                        qr_codes = pyzbar.decode(np.array(img_pag))
+                        if qr_codes:
+                            contenido = qr_codes[0].data.decode("utf-8", errors="ignore").strip()
+                            if debug:
+                                print("\n📡 TEXTO QR CRUDO DETECTADO (PDF):")
+                                print(contenido)
+                                print("=" * 60 + "\n")
+                            else:
+                                logger.info("[QR] Texto QR crudo detectado (PDF): %s", contenido)
+                            partes = contenido.split("|")
+                            if len(partes) >= 4:
+                                serie = partes[2].strip()
+                                correlativo = partes[3].strip().zfill(8)
+                                qr_datos["numero_documento"] = f"{serie}-{correlativo}" if serie else None
+                            if len(partes) >= 7:
+                                qr_datos["ruc_emisor"] = partes[0].strip() or None
+                                qr_datos["total"] = partes[5].strip() or None
+                                qr_datos["fecha_emision"] = partes[6].strip() or None
+                            if debug:
+                                print(f"[QR] Datos capturados (PDF) -> RUC: {qr_datos['ruc_emisor']}, "
+                                      f"NUM_DOC: {qr_datos['numero_documento']}, "
+                                      f"Total: {qr_datos['total']}, Fecha: {qr_datos['fecha_emision']}")
+                except Exception as e:
+                    logger.warning("[QR] No se pudo extraer QR de página PDF: %s", e)
+
+                if not any(k in txt.upper() for k in ["RUC", "TOTAL", "FECHA"]):
+                    if img_render is not None:
+                        img_pag = img_render
+                    else:
+                        img_pag = pag.to_image(resolution=100).original if hasattr(pag, "to_image") else pag
+                    if isinstance(img_pag, Image.Image):
+                        img_pag = asegurar_orientacion_vertical(img_pag, debug=debug)
+                        if img_pag.width > 1200 or img_pag.height < 1000:
+                            h = max(int(img_pag.height * 1200 / img_pag.width), 1000)
+                            w = int(img_pag.width * h / img_pag.height)
+                            img_pag = img_pag.resize((w, h), Image.Resampling.LANCZOS)
+                        img_gray = img_pag.convert("L")
+                        # La imagen binarizada se devuelve: el OCR se hace en lote para todas las páginas
+                        return txt, img_gray.point(lambda x: 0 if x < 150 else 255, "1")
+                return txt, None
+
+            max_threads = min(len(paginas), multiprocessing.cpu_count())
+            with ThreadPoolExecutor(max_workers=max_threads) as executor:
+                resultados = list(executor.map(procesar_pagina, paginas))
+            textos = [txt for txt, _ in resultados]
+
+            # Páginas sin texto útil: un tesseract por bloque de páginas, no uno por página
+            pendientes = [i for i, (_, img_bin) in enumerate(resultados) if img_bin is not None]
+            for i, txt in zip(pendientes, ocr_paginas([resultados[i][1] for i in pendientes], lang="spa")):
+                textos[i] = txt
+            texto = "\n".join(textos)
 
     # --- Texto ya extraído ---
     elif isinstance(entrada, str):
@@ -925,29 +1197,52 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
             "tipo_documento": "OTROS"
         }
 
-    lineas = [l.strip() for l in texto.splitlines() if l.strip()]
-    primeras_lineas = lineas[:100]
+    # --- Cache por hash del contenido: el mismo texto no repite los detectores ---
+    texto_hash = hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest()
+    clave_cache = f"ocr_campos_{texto_hash}_{qr_datos['ruc_emisor'] or ''}"
+    campos = cache.get(clave_cache)
 
-    debug_msg = ["\n📝 OCR LINEAS CRUDAS (máx 100 líneas):", "=" * 60]
-    for i, linea in enumerate(primeras_lineas):
-        linea_corta = (linea[:120] + "...") if len(linea) > 120 else linea
-        debug_msg.append(f"{i+1:02d}: {linea_corta}")
-    debug_msg.append("=" * 60 + "\n")
+    if campos is None:
+        # Volcado de líneas crudas: solo con debug=True o logger en nivel DEBUG
+        if debug or logger.isEnabledFor(logging.DEBUG):
+            primeras_lineas = islice((l.strip() for l in texto.splitlines() if l.strip()), 100)
 
-    if debug:
-        print("\n".join(debug_msg))
-    else:
-        for m in debug_msg:
-            logger.info(m)
+            debug_msg = ["\n📝 OCR LINEAS CRUDAS (máx 100 líneas):", "=" * 60]
+            for i, linea in enumerate(primeras_lineas):
+                linea_corta = (linea[:120] + "...") if len(linea) > 120 else linea
+                debug_msg.append(f"{i+1:02d}: {linea_corta}")
+            debug_msg.append("=" * 60 + "\n")
 
-    # --- Detectores individuales ---
-    ruc = detectar_ruc(texto) or qr_datos["ruc_emisor"]
+            if debug:
+                print("\n".join(debug_msg))
+            else:
+                logger.debug("\n".join(debug_msg))
+
+        # --- Detectores individuales (solo texto, la DB se consulta fuera del cache) ---
+        # La fecha no se cachea: detectar_fecha compara con la fecha actual (rango de 5 años)
+        # Mayúsculas y espacios compactados se calculan una vez para todos los detectores
+        ruc_texto = detectar_ruc(texto)
+        ruc_ocr = ruc_texto or qr_datos["ruc_emisor"]
+        texto_mayus = texto.upper()
+        texto_norm = compactar_espacios(texto_mayus)
+        campos = {
+            "ruc": ruc_ocr,
+            "razon_social": detectar_razon_social(texto, ruc_ocr, consultar_db=False, texto_norm=texto_norm),
+            "numero_documento": detectar_numero_documento(texto, texto_mayus=texto_mayus, ruc=ruc_texto or ""),
+            "total": detectar_total(texto),
+            "tipo_documento": detectar_tipo_documento(texto, debug=debug, texto_norm=texto_norm),
+        }
+        cache.set(clave_cache, campos, CACHE_OCR_TIMEOUT)
+
+    ruc = campos["ruc"]
     if qr_datos["ruc_emisor"]:
         qr_campos_usados["ruc"] = True
 
-    razon_social = detectar_razon_social(texto, ruc)
+    razon_social = razon_social_desde_db(ruc, debug=debug) if ruc else None
+    if razon_social is None:
+        razon_social = campos["razon_social"]
 
-    numero_doc = qr_datos["numero_documento"] or detectar_numero_documento(texto)
+    numero_doc = qr_datos["numero_documento"] or campos["numero_documento"]
     if qr_datos["numero_documento"]:
         qr_campos_usados["numero_documento"] = True
 
@@ -955,11 +1250,11 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
     if qr_datos["fecha_emision"]:
         qr_campos_usados["fecha"] = True
 
-    total = detectar_total(texto) or qr_datos["total"]
+    total = campos["total"] or qr_datos["total"]
     if qr_datos["total"]:
         qr_campos_usados["total"] = True
 
-    tipo_documento = detectar_tipo_documento(texto, debug=debug)
+    tipo_documento = campos["tipo_documento"]
 
     if debug:
         print("🔹 Datos detectados por OCR (con QR backup):")
@@ -970,11 +1265,12 @@ def procesar_datos_ocr(entrada: Union[str, Image.Image], debug: bool = True) ->
         print(f"  - Total            : {total} {'(desde QR)' if qr_campos_usados['total'] else ''}")
         print(f"  - Tipo Documento   : {tipo_documento}\n")
     else:
-        logger.info("🔹 Datos detectados por OCR (con QR backup):")
-        for k, v in [("RUC", ruc), ("Razón Social", razon_social),
-                     ("Número Documento", numero_doc), ("Fecha", fecha),
-                     ("Total", total), ("Tipo Documento", tipo_documento)]:
-            logger.info(f"{k}: {v}")
+        # Una sola línea de log por documento, formateada solo si INFO está activo
+        logger.info(
+            "🔹 Datos detectados por OCR (con QR backup): RUC: %s | Razón Social: %s | "
+            "Número Documento: %s | Fecha: %s | Total: %s | Tipo Documento: %s",
+            ruc, razon_social, numero_doc, fecha, total, tipo_documento
+        )
 
     return {
         "ruc": ruc or None,
@@ -992,9 +1288,6 @@ def asegurar_orientacion_vertical(img: Image.Image, debug: bool = False) -> Imag
     - Usa proporción width/height.
     - Aplica deskew con pytesseract OSD.
     """
-    from PIL import ExifTags
-    import pytesseract
-
     # 🔹 Corrección EXIF
     try:
         for orientation in ExifTags.TAGS.keys():
@@ -1107,7 +1400,7 @@ def preprocesar_imagen_para_ocr(ruta_imagen: str) -> str:
         return ruta_final
 
     except Exception as e:
-        logger.error(f"[OCR Utils] Error preprocesando imagen {ruta_imagen}: {e}", exc_info=True)
+        logger.error("[OCR Utils] Error preprocesando imagen %s: %s", ruta_imagen, e, exc_info=True)
         return ruta_imagen
 
 def corregir_perspectiva(img: np.ndarray, debug: bool = False) -> np.ndarray:
@@ -1118,9 +1411,6 @@ def corregir_perspectiva(img: np.ndarray, debug: bool = False) -> np.ndarray:
     - debug: muestra pasos intermedios
     Devuelve la imagen corregida.
     """
-    import cv2
-    import numpy as np
-
     # Convertir a gris
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
@@ -1130,7 +1420,7 @@ def corregir_perspectiva(img: np.ndarray, debug: bool = False) -> np.ndarray:
 
     # Buscar contornos
     contornos, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    contornos = sorted(contornos, key=cv2.contourArea, reverse=True)[:5]
+    contornos = heapq.nlargest(5, contornos, key=cv2.contourArea)
 
     doc_cnt = None
     for c in contornos:
@@ -1189,6 +1479,9 @@ def corregir_perspectiva(img: np.ndarray, debug: bool = False) -> np.ndarray:
 # ==================#
 logger = logging.getLogger(__name__)
 
+_RE_NUMERO_QR = re.compile(r"^\d+(\.\d+)?$")
+_RE_FECHA_QR = re.compile(r"(\d{2}/\d{2}/\d{4}|\d{2}-\d{2}-\d{4}|\d{4}-\d{2}-\d{2})")
+
 def extraer_datos_qr(img: Image.Image, debug: bool = False) -> Dict[str, Optional[str]]:
     """
     Extrae datos crudos desde el QR en la imagen PIL.
@@ -1239,7 +1532,7 @@ def extraer_datos_qr(img: Image.Image, debug: bool = False) -> Dict[str, Optiona
             print("\n📡 TEXTO QR EXTRAIDO:")
             print(contenido)
             print("="*60 + "\n")
-        logger.info(f"[QR] Texto QR extraído: {contenido}")
+        logger.info("[QR] Texto QR extraído: %s", contenido)
 
         partes = contenido.split("|")
         if len(partes) >= 4:
@@ -1269,7 +1562,7 @@ def extraer_datos_qr(img: Image.Image, debug: bool = False) -> Dict[str, Optiona
 
             for p in partes[4:]:
                 p_clean = p.replace(",", ".")
-                if re.match(r"^\d+(\.\d+)?$", p_clean):
+                if _RE_NUMERO_QR.match(p_clean):
                     p_int = p_clean.replace(".", "")
                     if p_int in (ruc_clean, numdoc_clean):
                         continue
@@ -1286,9 +1579,8 @@ def extraer_datos_qr(img: Image.Image, debug: bool = False) -> Dict[str, Optiona
 
             # Fecha: normalizado a YYYY-MM-DD
             fecha = None
-            fecha_patron = re.compile(r"(\d{2}/\d{2}/\d{4}|\d{2}-\d{2}-\d{4}|\d{4}-\d{2}-\d{2})")
             for p in partes:
-                m = fecha_patron.match(p.strip())
+                m = _RE_FECHA_QR.match(p.strip())
                 if m:
                     f = m.group(0)
                     if "/" in f:  # DD/MM/YYYY → YYYY-MM-DD
@@ -1302,17 +1594,16 @@ def extraer_datos_qr(img: Image.Image, debug: bool = False) -> Dict[str, Optiona
                     break
             datos["fecha_emision"] = fecha
 
-            logger.info(f"[QR] Datos capturados -> RUC: {datos['ruc_emisor']}, "
-                        f"NUM_DOC: {datos['numero_documento']}, "
-                        f"Total: {datos['total']}, Fecha: {datos['fecha_emision']}, "
-                        f"TipoDoc: {datos['tipo_documento']}")
+            logger.info("[QR] Datos capturados -> RUC: %s, NUM_DOC: %s, Total: %s, Fecha: %s, TipoDoc: %s",
+                        datos["ruc_emisor"], datos["numero_documento"], datos["total"],
+                        datos["fecha_emision"], datos["tipo_documento"])
         else:
-            logger.warning(f"[QR] Estructura inesperada en QR: {partes}")
+            logger.warning("[QR] Estructura inesperada en QR: %s", partes)
 
     except Exception as e:
         if debug:
             print(f"⚠️ Error extrayendo QR: {e}")
-        logger.error(f"[QR] Error extrayendo datos: {e}", exc_info=True)
+        logger.error("[QR] Error extrayendo datos: %s", e, exc_info=True)
 
     return datos
 
@@ -1340,17 +1631,54 @@ def detectar_qr(ruta_archivo: str, debug: bool = False) -> dict:
 # ===================#
 # CONVERSION DE PDFs #
 # ===================#
-def archivo_a_imagenes(archivo) -> Tuple[List[Image.Image], List[str]]:
+# Tamaño mínimo que se conserva al decodificar JPEG con Image.draft()
+TAMANO_DRAFT_OCR = (2000, 2000)
+# Resolución de rasterizado de PDFs: 200 DPI basta para boletas impresas
+# y genera ~2.25 veces menos píxeles que 300 DPI (ajustable con OCR_DPI)
+DPI_OCR = int(os.environ.get("OCR_DPI", "200"))
+
+def rasterizar_pdf(pdf_bytes: bytes, dpi: int = DPI_OCR) -> Iterator[Image.Image]:
+    """
+    Convierte los bytes de un PDF a imágenes en escala de grises, con poppler
+    en varios hilos y JPEG como formato intermedio (menos E/S que PPM).
+    Las páginas se escriben a disco y se abren de a una: quien consume el
+    generador sin acumular las imágenes (ej. debug_ocr_pdf) mantiene en memoria
+    solo las páginas en curso, no el PDF completo decodificado.
+    """
+    with tempfile.TemporaryDirectory() as carpeta:
+        rutas = convert_from_bytes(
+            pdf_bytes, dpi=dpi, grayscale=True, fmt="jpeg",
+            thread_count=multiprocessing.cpu_count(),
+            output_folder=carpeta, paths_only=True
+        )
+        for ruta in rutas:
+            img = Image.open(ruta)
+            img.load()  # carga los píxeles y libera el archivo temporal
+            yield img
+
+def preparar_para_ocr(img: Image.Image) -> Image.Image:
+    """
+    Escala de grises + binarización Otsu, una sola vez antes de tesseract:
+    le llega una imagen de 1 canal ya umbralizada en vez de RGB.
+    """
+    arr = np.asarray(img if img.mode == "L" else img.convert("L"))
+    _, bw = cv2.threshold(arr, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return Image.fromarray(bw)
+
+def archivo_a_imagenes(archivo, dpi: int = DPI_OCR) -> Tuple[List[Image.Image], List[str]]:
     """
     Convierte un archivo PDF o imagen a una lista de objetos PIL.Image.
+    Devuelve todas las páginas juntas en memoria (no es streaming); para recorrer
+    un PDF largo página por página usar rasterizar_pdf directamente.
     Estrategia híbrida:
       1) Si es PDF, intenta extraer texto nativo con pdfplumber.
       2) Si encuentra texto útil (RUC, TOTAL, FECHA, etc.), lo devuelve sin OCR.
       3) Si no encuentra texto o es un escaneo, convierte a imágenes para OCR.
-      4) Si es imagen, la devuelve directamente para OCR.
+      4) Si es imagen, la devuelve binarizada para OCR (JPEG se decodifica reducido).
     
     Args:
         archivo: file-like object (PDF o imagen).
+        dpi: resolución para rasterizar PDFs escaneados.
     
     Returns:
         Tuple[List[Image.Image], List[str]]:
@@ -1369,51 +1697,150 @@ def archivo_a_imagenes(archivo) -> Tuple[List[Image.Image], List[str]]:
         archivo.seek(0)
 
         if es_pdf:
-            pdf_bytes = archivo.read()
-
             # Extraer texto nativo
             try:
-                with pdfplumber.open(archivo) as pdf:
-                    for page in pdf.pages:
-                        text = page.extract_text() or ""
-                        textos_nativos.append(text)
-                
-                texto_completo = " ".join(textos_nativos).upper()
-                if any(palabra in texto_completo for palabra in ["RUC", "TOTAL", "FECHA", "IMPORTE"]):
-                    print("📄 Texto nativo detectado en PDF, se usará sin OCR.")
+                textos_nativos = extraer_textos_pdf(archivo)
+                if tiene_texto_util(textos_nativos):
+                    logger.debug("📄 Texto nativo detectado en PDF, se usará sin OCR.")
                     return [], textos_nativos
 
             except Exception as e:
-                print(f"⚠️ Error leyendo texto nativo del PDF: {e}")
+                logger.warning("⚠️ Error leyendo texto nativo del PDF: %s", e)
+
+            # Los bytes solo hacen falta para rasterizar (PDF escaneado)
+            archivo.seek(0)
+            pdf_bytes = archivo.read()
 
             # Convertir PDF a imágenes
             try:
-                imagenes = convert_from_bytes(pdf_bytes, dpi=300)
-                print("🖼️ PDF convertido a imágenes para OCR.")
+                imagenes = [preparar_para_ocr(img) for img in rasterizar_pdf(pdf_bytes, dpi=dpi)]
+                logger.debug("🖼️ PDF convertido a imágenes para OCR.")
             except PDFInfoNotInstalledError:
-                print("❌ Poppler no está instalado o no se encuentra en el PATH.")
+                logger.error("❌ Poppler no está instalado o no se encuentra en el PATH.")
             except PDFPageCountError:
-                print(f"❌ PDF corrupto o ilegible: {nombre}")
-            except Exception as e:
-                print(f"❌ Error convirtiendo PDF a imágenes ({nombre}): {e}")
+                logger.error("❌ PDF corrupto o ilegible: %s", nombre)
+            except Exception:
+                logger.exception("❌ Error convirtiendo PDF a imágenes (%s)", nombre)
 
         else:
             # Intentar abrir como imagen
             try:
                 img = Image.open(archivo)
+                # JPEG: libjpeg decodifica directo a escala reducida y en grises
+                # (no-op para otros formatos)
+                img.draft("L", TAMANO_DRAFT_OCR)
                 img.load()
-                imagenes = [img]
+                imagenes = [preparar_para_ocr(img)]
             except UnidentifiedImageError:
-                print(f"❌ Archivo no es una imagen válida: {nombre}")
-            except Exception as e:
-                print(f"❌ Error abriendo imagen ({nombre}): {e}")
+                logger.error("❌ Archivo no es una imagen válida: %s", nombre)
+            except Exception:
+                logger.exception("❌ Error abriendo imagen (%s)", nombre)
 
-    except Exception as e:
-        print(f"❌ Error procesando el archivo ({nombre}): {e}")
+    except Exception:
+        logger.exception("❌ Error procesando el archivo (%s)", nombre)
 
     return imagenes, textos_nativos
 
-def debug_ocr_pdf(archivo):
+def paginas_para_ocr(archivo) -> int:
+    """
+    Cantidad de imágenes que devolvería archivo_a_imagenes, sin rasterizar ni
+    binarizar: 0 si el PDF trae texto nativo útil (o no se puede leer), el número
+    de páginas si es un PDF escaneado y 1 si es una imagen válida.
+    Sirve a quien solo necesita contar páginas y no usa las imágenes.
+    """
+    nombre = getattr(archivo, "name", "").lower()
+    try:
+        archivo.seek(0)
+        es_pdf = nombre.endswith(".pdf") or archivo.read(4)[:4] == b"%PDF"
+        archivo.seek(0)
+
+        if es_pdf:
+            # Aquí solo importa si hay texto útil: se extrae página por página
+            # y se corta en la primera con palabra clave
+            try:
+                with pdfplumber.open(archivo) as pdf:
+                    if tiene_texto_util(page.extract_text() or "" for page in pdf.pages):
+                        return 0
+            except Exception as e:
+                logger.warning("⚠️ Error leyendo texto nativo del PDF: %s", e)
+            archivo.seek(0)
+            return pdfinfo_from_bytes(archivo.read())["Pages"]
+
+        with Image.open(archivo) as img:
+            img.verify()
+        return 1
+    except Exception:
+        logger.exception("❌ Error contando páginas del archivo (%s)", nombre)
+        return 0
+    finally:
+        archivo.seek(0)
+
+# Máximo de imágenes por lista de tesseract (listas muy largas pueden colgar el proceso)
+MAX_PAGINAS_LOTE = 50
+
+def ejecutar_tesseract(entrada: str, lang: str = "spa") -> str:
+    """
+    Ejecuta tesseract sobre una imagen o una lista .txt de imágenes y devuelve stdout.
+    Las páginas ya se reparten entre hilos (un tesseract por hilo): con OpenMP cada
+    proceso abriría además un hilo por núcleo, así que solo a este subproceso se le
+    pasa OMP_THREAD_LIMIT=1 (salvo que ya venga configurado en el entorno).
+    """
+    entorno = {**os.environ, "OMP_THREAD_LIMIT": os.environ.get("OMP_THREAD_LIMIT", "1")}
+    proceso = subprocess.run(
+        [pytesseract.pytesseract.tesseract_cmd, entrada, "stdout", "-l", lang],
+        capture_output=True, env=entorno,
+    )
+    if proceso.returncode != 0:
+        raise pytesseract.TesseractError(
+            proceso.returncode, proceso.stderr.decode("utf-8", errors="ignore").strip()
+        )
+    return proceso.stdout.decode("utf-8", errors="ignore")
+
+def ocr_lote(imagenes: List[Image.Image], lang: str = "spa") -> List[str]:
+    """
+    OCR de varias páginas con una sola ejecución de tesseract por bloque:
+    se guardan las imágenes en un directorio temporal y se pasa a tesseract
+    un .txt con sus rutas, así el modelo se carga una vez y no una por página.
+    Devuelve un texto por imagen, en el mismo orden.
+    """
+    textos: List[str] = []
+    for inicio in range(0, len(imagenes), MAX_PAGINAS_LOTE):
+        bloque = imagenes[inicio:inicio + MAX_PAGINAS_LOTE]
+        with tempfile.TemporaryDirectory(prefix="ocr_lote_") as carpeta:
+            rutas = []
+            for i, img in enumerate(bloque):
+                ruta = os.path.join(carpeta, f"pagina_{i:03d}.png")
+                # Archivo de paso que se borra enseguida: compresión mínima, escritura rápida
+                img.save(ruta, compress_level=1)
+                rutas.append(ruta)
+            lista = os.path.join(carpeta, "paginas.txt")
+            with open(lista, "w", encoding="utf-8") as f:
+                f.write("\n".join(rutas) + "\n")
+            salida = ejecutar_tesseract(lista, lang=lang)
+
+            # tesseract separa las páginas con un salto de página (\x0c)
+            partes = salida.split("\x0c")
+            if len(partes) < len(bloque):
+                partes = [ejecutar_tesseract(ruta, lang=lang) for ruta in rutas]
+        textos.extend(partes[:len(bloque)])
+    return textos
+
+def ocr_paginas(imagenes: List[Image.Image], lang: str = "spa", max_workers: Optional[int] = None) -> List[str]:
+    """
+    Aplica OCR a varias páginas en paralelo y devuelve los textos en el mismo orden.
+    Las páginas se reparten en un bloque por hilo y cada bloque va a ocr_lote,
+    así se paraleliza sin pagar la carga del modelo en cada página.
+    """
+    if len(imagenes) <= 1:
+        return ocr_lote(imagenes, lang=lang)
+
+    max_threads = max_workers or min(len(imagenes), multiprocessing.cpu_count())
+    tamano = -(-len(imagenes) // max_threads)
+    bloques = [imagenes[i:i + tamano] for i in range(0, len(imagenes), tamano)]
+    with ThreadPoolExecutor(max_workers=len(bloques)) as executor:
+        return [texto for textos in executor.map(lambda b: ocr_lote(b, lang=lang), bloques) for texto in textos]
+
+def debug_ocr_pdf(archivo, dpi: int = DPI_OCR):
     """
     Convierte un PDF o imagen a texto usando pytesseract
     y muestra línea por línea el OCR crudo.
@@ -1422,85 +1849,143 @@ def debug_ocr_pdf(archivo):
         archivo.seek(0)
         if archivo.name.lower().endswith(".pdf"):
             pdf_bytes = archivo.read()
-            imagenes = convert_from_bytes(pdf_bytes, dpi=300)
+            paginas = rasterizar_pdf(pdf_bytes, dpi=dpi)
         else:
             img = Image.open(archivo)
             img.load()
-            imagenes = [img]
-
-        for i, img in enumerate(imagenes):
-            texto_crudo = pytesseract.image_to_string(img, lang="spa")
-            print(f"\n📄 Página {i+1} texto crudo:\n{'-'*50}\n{texto_crudo}\n{'-'*50}")
-
-    except Exception as e:
-        print(f"❌ Error procesando OCR: {e}")
+            paginas = iter([img])
+
+        # Bloques de tantas páginas como núcleos: el OCR sigue en paralelo
+        # y en memoria solo vive el bloque en curso, no el PDF completo
+        tamano = multiprocessing.cpu_count()
+        numero = 0
+        for bloque in iter(lambda: list(islice(paginas, tamano)), []):
+            for texto_crudo in ocr_paginas([preparar_para_ocr(img) for img in bloque]):
+                numero += 1
+                print(f"\n📄 Página {numero} texto crudo:\n{'-'*50}\n{texto_crudo}\n{'-'*50}")
+
+    except Exception:
+        logger.exception("❌ Error procesando OCR")
           
 # ============================#
 # GENERAR NUMERO DE OPERACIÓN #
 # ============================#
+_RE_CORRELATIVO_OPERACION = re.compile(r"-(\d+)$")
+
+def ultimo_numero_documento(prefix: str, fecha_str: str) -> int:
+    """
+    Mayor correlativo ya usado en DocumentoGasto para PREFIX-YYYYMMDD.
+    Solo se consulta al crear el contador del día.
+    """
+    from boleta_api.models import DocumentoGasto
+
+    # MAX sobre la columna (única, ya indexada): un solo valor, sin ORDER BY
+    ultimo = (
+        DocumentoGasto.objects
+        .filter(numero_operacion__startswith=f"{prefix}-{fecha_str}")
+        .aggregate(ultimo=Max("numero_operacion"))["ultimo"]
+    )
+    m = _RE_CORRELATIVO_OPERACION.search(ultimo) if ultimo else None
+    return int(m.group(1)) if m else 0
+
 def generar_numero_operacion(prefix: str = "DOC") -> str:
     """
     Genera un número de operación único, usando fecha + contador.
     Formato: PREFIX-YYYYMMDD-XXXX
+    El contador vive en OperacionSecuencia (una fila por prefijo y día, bloqueada
+    con select_for_update), así no se recorre DocumentoGasto en cada llamada.
     """
-    from boleta_api.models import DocumentoGasto
+    from boleta_api.models import OperacionSecuencia
+
+    # Mismo día que OperacionSecuencia.generar_numero (zona horaria de Django)
+    hoy = timezone.localdate()
+    fecha_str = hoy.strftime("%Y%m%d")
 
     with transaction.atomic():
-        hoy = date.today()
-        fecha_str = hoy.strftime("%Y%m%d")
-
-        ultimo = (
-            DocumentoGasto.objects
-            .filter(numero_operacion__startswith=f"{prefix}-{fecha_str}")
-            .order_by('-numero_operacion')
-            .first()
+        secuencia_obj, _ = OperacionSecuencia.objects.select_for_update().get_or_create(
+            tipo=prefix,
+            fecha=hoy,
+            # Continúa desde los números que ya existan hoy
+            defaults={"secuencia": lambda: ultimo_numero_documento(prefix, fecha_str)},
         )
+        secuencia_obj.secuencia += 1
+        secuencia_obj.save(update_fields=["secuencia"])
 
-        if ultimo:
-            try:
-                ultimo_num = int(ultimo.numero_operacion.split("-")[-1])
-            except ValueError:
-                ultimo_num = 0
-        else:
-            ultimo_num = 0
-
-        nuevo_num = ultimo_num + 1
-        return f"{prefix}-{fecha_str}-{nuevo_num:04d}"
+    return f"{prefix}-{fecha_str}-{secuencia_obj.secuencia:04d}"
 
 # =======================================#
 #  SECCIÓN GESTIÓN DE CAJA / SOLICITUDES #
 # =======================================#
-def aprobar_solicitud(solicitud_id):
+def aprobar_solicitudes(solicitudes_ids) -> int:
+    """
+    Aprueba en bloque las solicitudes indicadas que aún no estén aprobadas
+    y suma sus montos a la caja del día con un solo UPDATE.
+    Retorna la cantidad de solicitudes aprobadas.
+    """
     from boleta_api.models import CajaDiaria, Solicitud
-    solicitud = Solicitud.objects.get(id=solicitud_id)
-    if solicitud.estado == "Aprobada":
-        return
-    solicitud.estado = "Aprobada"
-    solicitud.save()
-    
-    hoy = date.today()
-    caja, _ = CajaDiaria.objects.get_or_create(fecha=hoy)
-    monto_actual = float(caja.monto_gastado or 0)
-    monto_suma = float(solicitud.monto_soles or 0)
-    caja.monto_gastado = monto_actual + monto_suma
-    caja.actualizar_sobrante()
+    with transaction.atomic():
+        pendientes = list(
+            Solicitud.objects.select_for_update()
+            .filter(id__in=solicitudes_ids)
+            .exclude(estado="Aprobada")
+            .values_list("id", "total_soles")
+        )
+        if not pendientes:
+            return 0
+
+        Solicitud.objects.filter(id__in=[sid for sid, _ in pendientes]).update(estado="Aprobada")
+        monto_suma = sum((monto or Decimal("0") for _, monto in pendientes), Decimal("0"))
+
+        hoy = timezone.localdate()
+        caja, _ = CajaDiaria.objects.get_or_create(fecha=hoy)
+        # Gastado y sobrante en el mismo UPDATE (equivale a actualizar_sobrante()).
+        # monto_sobrante va primero: MySQL evalúa las asignaciones del SET en orden.
+        gastado_nuevo = F("monto_gastado") + monto_suma
+        CajaDiaria.objects.filter(pk=caja.pk).update(
+            monto_sobrante=Greatest(F("monto_inicial") - gastado_nuevo, Value(Decimal("0"))),
+            monto_gastado=gastado_nuevo,
+        )
 
-def set_monto_diario(fecha: date, monto: float):
+    return len(pendientes)
+
+def aprobar_solicitud(solicitud_id):
+    aprobar_solicitudes([solicitud_id])
+
+def set_montos_diarios(montos_por_fecha: Dict[date, float]) -> dict:
+    """
+    Establece el monto inicial de varias cajas diarias en bloque:
+    crea las que no existen y actualiza el resto con un solo bulk_update.
+    Retorna {fecha: CajaDiaria}.
+    """
     from boleta_api.models import CajaDiaria
-    caja, creado = CajaDiaria.objects.get_or_create(fecha=fecha, defaults={
-        'monto_inicial': monto,
-        'monto_gastado': 0,
-        'monto_sobrante': monto,
-    })
-    if not creado:
-        caja.monto_inicial = monto
-        caja.actualizar_sobrante()
-    return caja
+    with transaction.atomic():
+        cajas = CajaDiaria.objects.select_for_update().in_bulk(list(montos_por_fecha), field_name="fecha")
+        nuevas, actualizadas = [], []
+        for fecha, monto in montos_por_fecha.items():
+            monto = Decimal(str(monto))
+            caja = cajas.get(fecha)
+            if caja is None:
+                caja = CajaDiaria(fecha=fecha, monto_inicial=monto, monto_gastado=0, monto_sobrante=monto)
+                nuevas.append(caja)
+                cajas[fecha] = caja
+            else:
+                caja.monto_inicial = monto
+                caja.monto_sobrante = max(monto - caja.monto_gastado, 0)
+                actualizadas.append(caja)
+
+        CajaDiaria.objects.bulk_create(nuevas)
+        CajaDiaria.objects.bulk_update(actualizadas, ["monto_inicial", "monto_sobrante"])
+
+    return cajas
+
+def set_monto_diario(fecha: date, monto: float):
+    return set_montos_diarios({fecha: monto})[fecha]
 
 def validar_caja_abierta():
     from boleta_api.models import EstadoCaja
-    estado_caja = EstadoCaja.objects.order_by('-fecha_hora').first()
-    if not estado_caja or estado_caja.estado != EstadoCaja.ABIERTO:
+    # Solo la columna estado del último registro, sin instanciar el modelo
+    estado = EstadoCaja.objects.order_by('-fecha_hora').values_list('estado', flat=True).first()
+    if estado != EstadoCaja.ABIERTO:
         raise ValidationError("La caja no está abierta.")
 
 def validar_arqueo_unico_por_fecha(fecha):
@@ -1510,6 +1995,11 @@ def validar_arqueo_unico_por_fecha(fecha):
 
 def validar_solicitudes_no_asociadas(solicitudes_ids):
     from boleta_api.models import Solicitud
-    for sid in solicitudes_ids:
-        if Solicitud.objects.filter(id=sid, arqueo__cerrada=False).exists():
-            raise ValidationError(f"La solicitud {sid} ya está asociada a un arqueo abierto.")
+    asociadas = sorted(
+        Solicitud.objects.filter(id__in=solicitudes_ids, arqueo__cerrada=False)
+        .values_list("id", flat=True)
+    )
+    if len(asociadas) == 1:
+        raise ValidationError(f"La solicitud {asociadas[0]} ya está asociada a un arqueo abierto.")
+    if asociadas:
+        raise ValidationError(f"Las solicitudes {asociadas} ya están asociadas a un arqueo abierto.")
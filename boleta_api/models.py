@@ -662,7 +662,7 @@ class OperacionSecuencia(models.Model):
 
     @classmethod
     def generar_numero(cls, tipo: str) -> str:
-        fecha_actual = timezone.now().date()
+        fecha_actual = timezone.localdate()
         with transaction.atomic():
             secuencia_obj, creado = cls.objects.select_for_update().get_or_create(
                 tipo=tipo,
@@ -670,7 +670,7 @@ class OperacionSecuencia(models.Model):
                 defaults={'secuencia': 0}
             )
             secuencia_obj.secuencia += 1
-            secuencia_obj.save()
+            secuencia_obj.save(update_fields=["secuencia"])
         return f"{tipo.upper()}-{fecha_actual.strftime('%Y%m%d')}-{str(secuencia_obj.secuencia).zfill(4)}"
 
 class EstadoCaja(models.Model):
@@ -2,7 +2,7 @@ from celery import shared_task
 from io import BytesIO
 import base64
 import pytesseract
-from .extraccion import procesar_datos_ocr, extraer_datos_qr
+from .extraccion import procesar_datos_ocr, extraer_datos_qr, ocr_paginas, preparar_para_ocr
 from pdf2image import convert_from_bytes
 import pdfplumber
 from PIL import Image
@@ -22,6 +22,20 @@ if not logger.handlers:
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
+# Ancho máximo (px) de las páginas que se pasan a OCR
+ANCHO_MAX_OCR = 1200
+
+def dpi_para_pagina(page, dpi_max: int) -> int:
+    """
+    DPI con el que la página sale de poppler con ANCHO_MAX_OCR px de ancho
+    (page.width está en puntos, 72 por pulgada), sin pasar de dpi_max.
+    Así no se rasteriza a más resolución solo para reducirla después.
+    """
+    ancho_pulgadas = float(page.width or 0) / 72
+    if ancho_pulgadas <= 0:
+        return dpi_max
+    return max(1, min(dpi_max, int(ANCHO_MAX_OCR / ancho_pulgadas)))
+
 @shared_task(bind=True)
 def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
                                tipo_documento="Boleta", concepto="Solicitud de gasto",
@@ -51,22 +65,21 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
             with pdfplumber.open(BytesIO(archivo_bytes)) as pdf:
                 paginas = list(pdf.pages)
 
-                def procesar_pagina(idx_pag):
+                def rasterizar_pagina(idx_pag):
                     page = paginas[idx_pag]
                     texto_crudo = (page.extract_text() or "").strip()
-                    img_b64 = None
                     imagen = None
 
-                    # DPI dinámico
-                    dpi_pag = 100 if texto_crudo and len(texto_crudo) > 50 else 220
+                    # DPI dinámico (limitado al necesario para ANCHO_MAX_OCR)
+                    dpi_pag = dpi_para_pagina(page, 100 if texto_crudo and len(texto_crudo) > 50 else 220)
                     if not any(k in texto_crudo.upper() for k in ["RUC", "TOTAL", "FECHA"]):
                         imagen = convert_from_bytes(
                             archivo_bytes, dpi=dpi_pag, first_page=idx_pag+1, last_page=idx_pag+1
                         )[0]
 
-                        if imagen.width > 1200:
-                            h = int(imagen.height * 1200 / imagen.width)
-                            imagen = imagen.resize((1200, h), resample_method)
+                        if imagen.width > ANCHO_MAX_OCR:
+                            h = int(imagen.height * ANCHO_MAX_OCR / imagen.width)
+                            imagen = imagen.resize((ANCHO_MAX_OCR, h), resample_method)
 
                         if imagen.width > imagen.height:
                             try:
@@ -74,15 +87,20 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
                                 rotation = int([line for line in osd.split("\n") if "Rotate:" in line][0].split(":")[1].strip())
                                 if rotation != 0:
                                     imagen = imagen.rotate(rotation, expand=True)
-                            except:
+                            except (pytesseract.TesseractError, IndexError, ValueError):
                                 pass
 
-                        texto_crudo = pytesseract.image_to_string(imagen, lang="spa")
+                    return texto_crudo, imagen
 
-                        if generar_imagenes:
-                            buffer_img = BytesIO()
-                            imagen.save(buffer_img, format="PNG")
-                            img_b64 = f"data:image/png;base64,{base64.b64encode(buffer_img.getvalue()).decode('utf-8')}"
+                def procesar_pagina(idx_pag):
+                    texto_crudo = textos[idx_pag]
+                    imagen = imagenes[idx_pag]
+                    img_b64 = None
+
+                    if imagen is not None and generar_imagenes:
+                        buffer_img = BytesIO()
+                        imagen.save(buffer_img, format="PNG")
+                        img_b64 = f"data:image/png;base64,{base64.b64encode(buffer_img.getvalue()).decode('utf-8')}"
 
                     # --- OCR detectores ---
                     datos = procesar_datos_ocr(texto_crudo, debug=False)
@@ -91,7 +109,7 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
                     if imagen is not None:
                         datos_qr = extraer_datos_qr(imagen, debug=True)
                         if any(datos_qr.values()):
-                            logger.info(f"[QR] Página {idx_pag+1}: QR detectado {datos_qr}")
+                            logger.info("[QR] Página %d: QR detectado %s", idx_pag + 1, datos_qr)
                             # Merge: QR tiene prioridad
                             datos.update({k: v for k, v in datos_qr.items() if v})
 
@@ -107,6 +125,17 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
 
                 max_threads = min(len(paginas), multiprocessing.cpu_count() * 2)
                 with ThreadPoolExecutor(max_workers=max_threads) as executor:
+                    rasterizadas = list(executor.map(rasterizar_pagina, range(len(paginas))))
+                    textos = [texto for texto, _ in rasterizadas]
+                    imagenes = [imagen for _, imagen in rasterizadas]
+
+                    # 🔹 Las páginas sin texto útil pasan juntas por OCR (un tesseract por bloque, no por página),
+                    # binarizadas con Otsu; la imagen original se conserva para el QR y la vista previa
+                    pendientes = [i for i, imagen in enumerate(imagenes) if imagen is not None]
+                    binarizadas = list(executor.map(preparar_para_ocr, [imagenes[i] for i in pendientes]))
+                    for i, texto_ocr in zip(pendientes, ocr_paginas(binarizadas, lang="spa")):
+                        textos[i] = texto_ocr
+
                     resultados = list(executor.map(procesar_pagina, range(len(paginas))))
 
         else:
@@ -118,9 +147,9 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
                 imagen = imagen.convert("RGB")
 
             # Redimensionar si es muy ancha
-            if imagen.width > 1200:
-                h = int(imagen.height * 1200 / imagen.width)
-                imagen = imagen.resize((1200, h), resample_method)
+            if imagen.width > ANCHO_MAX_OCR:
+                h = int(imagen.height * ANCHO_MAX_OCR / imagen.width)
+                imagen = imagen.resize((ANCHO_MAX_OCR, h), resample_method)
 
             # Asegurar orientación vertical
             if imagen.width > imagen.height:
@@ -129,14 +158,14 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
                     rotation = int([line for line in osd.split("\n") if "Rotate:" in line][0].split(":")[1].strip())
                     if rotation != 0:
                         imagen = imagen.rotate(rotation, expand=True)
-                except:
+                except (pytesseract.TesseractError, IndexError, ValueError):
                     pass
 
             # --- QR detectores primero ---
             datos_qr = extraer_datos_qr(imagen, debug=True)
 
             # --- OCR de la imagen ---
-            texto_crudo = pytesseract.image_to_string(imagen, lang="spa")
+            texto_crudo = ocr_paginas([preparar_para_ocr(imagen)], lang="spa")[0]
             img_b64 = None
             if generar_imagenes:
                 buffer_img = BytesIO()
@@ -148,7 +177,7 @@ def procesar_documento_celery(self, ruta_archivo, nombre_archivo,
 
             # Merge QR con prioridad
             if any(datos_qr.values()):
-                logger.info(f"[QR] Imagen única: QR detectado {datos_qr}")
+                logger.info("[QR] Imagen única: QR detectado %s", datos_qr)
                 datos.update({k: v for k, v in datos_qr.items() if v})
 
             datos["tipo_documento"] = (datos.get("tipo_documento") or tipo_documento).capitalize()
@@ -0,0 +1,206 @@
+# boleta_project/boleta_api/test_extraccion.py
+
+import subprocess
+from io import BytesIO
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+from boleta_api.extraccion import (
+    corregir_texto_ocr,
+    detectar_fecha,
+    detectar_ruc,
+    detectar_tipo_documento,
+    detectar_total,
+    normalizar_texto_ocr,
+    ocr_lote,
+    paginas_para_ocr,
+    PALABRAS_FECHA,
+    PALABRAS_TOTAL,
+    _RE_VALOR_FECHA,
+    _RE_VALOR_MONTO,
+)
+
+class CorreccionOCRTests(TestCase):
+
+    def test_palabras_comunes_no_se_tocan(self):
+        # Palabras reales a 1 letra de MARZO, JUNIO y FECHA, en líneas sin palabra clave ni fecha
+        texto = "ATENDIDO POR MARCO\nJUNTO AL MERCADO 123\nFICHA TECNICA"
+        self.assertEqual(corregir_texto_ocr(texto, PALABRAS_FECHA, _RE_VALOR_FECHA), texto)
+        # Tampoco en una línea que sí lleva fecha o palabra clave
+        texto = "FECHA 07/08/2025 ATENDIDO POR MARCO"
+        self.assertEqual(corregir_texto_ocr(texto, PALABRAS_FECHA, _RE_VALOR_FECHA), texto)
+
+    def test_corrige_en_lineas_con_valor(self):
+        self.assertEqual(corregir_texto_ocr("T0TAL S/ 46.20", PALABRAS_TOTAL, _RE_VALOR_MONTO), "TOTAL S/ 46.20")
+        self.assertEqual(corregir_texto_ocr("FEHCA: 07/08/2025", PALABRAS_FECHA, _RE_VALOR_FECHA), "FECHA: 07/08/2025")
+        self.assertEqual(
+            corregir_texto_ocr("5 DE SETIEMBRE DE 2025", PALABRAS_FECHA, _RE_VALOR_FECHA),
+            "5 DE SEPTIEMBRE DE 2025"
+        )
+
+    def test_fecha_no_habilita_correccion_del_total(self):
+        texto = "EMISION 03.06.2025 T0TAL ITEMS 3"
+        self.assertEqual(corregir_texto_ocr(texto, PALABRAS_TOTAL, _RE_VALOR_MONTO), texto)
+
+    def test_corrige_en_lineas_con_palabra_clave(self):
+        # Solo cambia la línea con palabra clave; el resto del texto queda igual
+        self.assertEqual(
+            corregir_texto_ocr("FECHA DE EMISI0N\nJUNTO A MARCO", PALABRAS_FECHA, _RE_VALOR_FECHA),
+            "FECHA DE EMISION\nJUNTO A MARCO"
+        )
+
+    def test_no_recorta_palabras_con_sufijo(self):
+        texto = "FACTURADO DESCUENTOS 46.20"
+        self.assertEqual(corregir_texto_ocr(texto, PALABRAS_TOTAL, _RE_VALOR_MONTO), texto)
+
+class CorreccionEnDetectoresTests(TestCase):
+
+    def test_total_no_lee_montos_dentro_de_fechas(self):
+        texto = "EMISION 03.06.2025 T0TAL ITEMS 3\nIMPORTE A PAGAR S/ 100.00"
+        self.assertEqual(detectar_total(texto), "100.00")
+
+    def test_tipo_documento_sin_correccion_difusa(self):
+        texto = "BOLETA DE VENTA ELECTRONICA B001-9\nCLIENTE VARIOS - FACTURADO 03/06/2025\nTOTAL 25.00"
+        self.assertEqual(detectar_tipo_documento(texto), "BOLETA DE VENTA ELECTRONICA")
+        self.assertEqual(detectar_tipo_documento("BOLETAS DE VENTA\nTOTAL 25.00"), "OTROS")
+
+    def test_fecha_no_corrige_palabras_comunes(self):
+        self.assertIsNone(detectar_fecha("MESA 5 MARCO 20 MARCO 12 CONSUMO 46.20"))
+
+    def test_fecha_invalida_no_tapa_la_siguiente(self):
+        self.assertEqual(detectar_fecha("B002-45\nSETIEMBRE 15 AGO 2025"), "2025-08-15")
+
+class DetectarFechaTests(TestCase):
+
+    def test_formatos_de_fecha(self):
+        self.assertEqual(detectar_fecha("FACTURA ELECTRONICA\nFECHA DE EMISION: 07/08/2025\nTOTAL S/ 46.20"), "2025-08-07")
+        self.assertEqual(detectar_fecha("Fecha: 15 ago 2025   Hora 10:11\n"), "2025-08-15")
+        self.assertEqual(detectar_fecha("Ticket\nFecha 03.06.2025\nAlgo sin montos\n"), "2025-06-03")
+        self.assertEqual(detectar_fecha("Fecha emision 12-Sep-2025\nTotal 11.80\n"), "2025-09-12")
+        self.assertEqual(detectar_fecha("sáb 2025/08/14\nUNIVERSIDAD\n"), "2025-08-14")
+        self.assertEqual(detectar_fecha("Lima, 20 DICIEMBRE 2024\nImporte: 450.00\n"), "2024-12-20")
+
+    def test_prioriza_la_linea_de_referencia(self):
+        # La fecha junto al número de documento gana a las demás
+        texto = "EMPRESA X S.A.C\n01/01/2010 antiguo\nF001-000123\nfecha 02/03/2025 y 2025/03/01\notra 15/02/2025\n"
+        self.assertEqual(detectar_fecha(texto), "2025-03-02")
+        # "FECHA DE EMISION" sin fecha en su línea toma la de la línea siguiente
+        texto = "FECHA DE EMISION:\n10/10/2025\nF001-0099 11/10/2025 12/10/2030\n"
+        self.assertEqual(detectar_fecha(texto), "2025-10-10")
+
+    def test_sin_fecha(self):
+        self.assertIsNone(detectar_fecha(""))
+        self.assertIsNone(detectar_fecha("NADA"))
+
+class DetectarRucTests(TestCase):
+
+    def test_ruc_con_palabra_clave(self):
+        self.assertEqual(detectar_ruc("TAI LOY S.A.\nRUC: 20100049181\nFACTURA ELECTRONICA\n"), "20100049181")
+        self.assertEqual(detectar_ruc("SUPERMERCADOS PERUANOS\nR.U.C. 20100070970\nBOLETA\n"), "20100070970")
+        self.assertEqual(detectar_ruc("MINIMARKET EL SOL S A C\nRuc:20512345678\nTK01-99887\n"), "20512345678")
+
+    def test_ruc_con_espacios(self):
+        self.assertEqual(detectar_ruc("ACADEMIA PREUNIVERSITARIA\nRUC: 20 4567 89012\n"), "20456789012")
+
+    def test_ruc_invalido(self):
+        # Letras O en lugar de ceros: no pasa la validación
+        self.assertIsNone(detectar_ruc("CONSTRUCTORA ALFA\nRUC 1O456789O12\n"))
+        self.assertIsNone(detectar_ruc(""))
+
+class NormalizarTextoOCRTests(TestCase):
+
+    def test_normaliza_lineas(self):
+        texto = (
+            "1 SUPERMERCADOS PERUANOS SOCIEDAD ANONIMA\n"
+            "Fecha: 15 ago 2025   Hora 10:11\n"
+            "ARROZ COSTEÑO 5KG     25,90\n"
+            "IMPORTE TOTAL: S/. 36,40\n"
+        )
+        esperado = (
+            "SUPERMERCADOS PERUANOS SOCIEDAD ANONIMA\n"
+            "FECHA 15 AGO 2025 HORA 10 11\n"
+            "ARROZ COSTENO 5KG 25,90\n"
+            "IMPORTE TOTAL S/. 36,40"
+        )
+        self.assertEqual(normalizar_texto_ocr(texto), esperado)
+
+    def test_reemplazos_ocr(self):
+        texto = "RUC: 20 4567 89012\nNº 001-0002345\nMonto total S/ 2.345.678,90\n"
+        esperado = "RUC 20 4567 89012\nNO 001-0002345\nMONTO TOTAL S/2.345.678,90"
+        self.assertEqual(normalizar_texto_ocr(texto), esperado)
+
+    def test_texto_vacio(self):
+        self.assertEqual(normalizar_texto_ocr(""), "")
+
+class OCRLoteTests(TestCase):
+
+    def setUp(self):
+        self.imagenes = [Image.new("L", (20, 20), color=255) for _ in range(3)]
+
+    def tesseract(self, salidas):
+        """Simula subprocess.run de tesseract devolviendo `salidas` en orden."""
+        return mock.patch(
+            "boleta_api.extraccion.subprocess.run",
+            side_effect=[subprocess.CompletedProcess([], 0, stdout=s.encode("utf-8"), stderr=b"") for s in salidas],
+        )
+
+    def test_separa_paginas_por_salto_de_pagina(self):
+        with self.tesseract(["pagina uno\n\x0cpagina dos\n\x0cpagina tres\n\x0c"]) as run:
+            textos = ocr_lote(self.imagenes)
+        self.assertEqual(textos, ["pagina uno\n", "pagina dos\n", "pagina tres\n"])
+        # Una sola ejecución de tesseract para todo el bloque, con OMP limitado solo en el subproceso
+        self.assertEqual(run.call_count, 1)
+        self.assertTrue(run.call_args.args[0][1].endswith("paginas.txt"))
+        self.assertIn("OMP_THREAD_LIMIT", run.call_args.kwargs["env"])
+
+    def test_reintenta_por_pagina_si_faltan_separadores(self):
+        with self.tesseract(["todo junto sin separar", "a", "b", "c"]) as run:
+            textos = ocr_lote(self.imagenes)
+        self.assertEqual(textos, ["a", "b", "c"])
+        self.assertEqual(run.call_count, 4)
+
+    def test_bloques_de_max_paginas(self):
+        with mock.patch("boleta_api.extraccion.MAX_PAGINAS_LOTE", 2), \
+                self.tesseract(["1\x0c2\x0c", "3\x0c"]) as run:
+            textos = ocr_lote(self.imagenes)
+        self.assertEqual(textos, ["1", "2", "3"])
+        self.assertEqual(run.call_count, 2)
+
+class PaginasParaOCRTests(TestCase):
+
+    def pdf(self, textos):
+        """Simula pdfplumber.open con una página por texto."""
+        paginas = [mock.Mock(**{"extract_text.return_value": t}) for t in textos]
+        abierto = mock.MagicMock()
+        abierto.__enter__.return_value.pages = paginas
+        return mock.patch("boleta_api.extraccion.pdfplumber.open", return_value=abierto), paginas
+
+    def archivo(self, contenido, nombre):
+        archivo = BytesIO(contenido)
+        archivo.name = nombre
+        return archivo
+
+    def test_pdf_con_texto_nativo(self):
+        parche, paginas = self.pdf(["RUC 20100049181 TOTAL 46.20", "no se lee"])
+        archivo = self.archivo(b"%PDF-1.4 ...", "boleta.pdf")
+        with parche:
+            self.assertEqual(paginas_para_ocr(archivo), 0)
+        # Se corta en la primera página con palabra clave
+        paginas[1].extract_text.assert_not_called()
+        self.assertEqual(archivo.tell(), 0)
+
+    def test_pdf_escaneado_cuenta_paginas(self):
+        parche, _ = self.pdf(["", None, ""])
+        archivo = self.archivo(b"%PDF-1.4 ...", "escaneo.pdf")
+        with parche, mock.patch("boleta_api.extraccion.pdfinfo_from_bytes", return_value={"Pages": 3}):
+            self.assertEqual(paginas_para_ocr(archivo), 3)
+        self.assertEqual(archivo.tell(), 0)
+
+    def test_imagen(self):
+        buffer = BytesIO()
+        Image.new("L", (20, 20), color=255).save(buffer, format="PNG")
+        self.assertEqual(paginas_para_ocr(self.archivo(buffer.getvalue(), "foto.png")), 1)
+
+    def test_archivo_invalido(self):
+        self.assertEqual(paginas_para_ocr(self.archivo(b"no es una imagen", "foto.png")), 0)
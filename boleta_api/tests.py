@@ -1,3 +1,105 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from boleta_api.extraccion import aprobar_solicitud, aprobar_solicitudes, set_montos_diarios
+from boleta_api.models import CajaDiaria, Solicitud
+
+
+class CajaSolicitudesTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username="solicitante", password="clave123")
+
+    def crear_solicitud(self, total_soles):
+        return Solicitud.objects.create(
+            solicitante=self.usuario,
+            area="Operaciones",
+            total_soles=Decimal(total_soles),
+            estado="Pendiente para Atención",
+        )
+
+    def test_aprobar_solicitud_descuenta_de_la_caja_del_dia(self):
+        hoy = timezone.localdate()
+        CajaDiaria.objects.create(fecha=hoy, monto_inicial=Decimal("500.00"), monto_sobrante=Decimal("500.00"))
+        solicitud = self.crear_solicitud("120.50")
+
+        aprobar_solicitud(solicitud.id)
+
+        caja = CajaDiaria.objects.get(fecha=hoy)
+        self.assertEqual(caja.monto_gastado, Decimal("120.50"))
+        self.assertEqual(caja.monto_sobrante, Decimal("379.50"))
+        solicitud.refresh_from_db()
+        self.assertEqual(solicitud.estado, "Aprobada")
+        # El numero_solicitud asignado en save() no se pierde con el UPDATE en bloque
+        self.assertTrue(solicitud.numero_solicitud.startswith("SG-"))
+
+    def test_aprobar_solicitudes_no_suma_dos_veces(self):
+        hoy = timezone.localdate()
+        CajaDiaria.objects.create(fecha=hoy, monto_inicial=Decimal("100.00"), monto_sobrante=Decimal("100.00"))
+        s1 = self.crear_solicitud("30.00")
+        s2 = self.crear_solicitud("90.00")
+
+        self.assertEqual(aprobar_solicitudes([s1.id, s2.id]), 2)
+        self.assertEqual(aprobar_solicitudes([s1.id, s2.id]), 0)
+
+        caja = CajaDiaria.objects.get(fecha=hoy)
+        self.assertEqual(caja.monto_gastado, Decimal("120.00"))
+        # El sobrante nunca queda negativo
+        self.assertEqual(caja.monto_sobrante, Decimal("0.00"))
+
+    def test_set_montos_diarios_crea_y_actualiza(self):
+        existente = date(2025, 8, 1)
+        nueva = date(2025, 8, 2)
+        CajaDiaria.objects.create(fecha=existente, monto_inicial=Decimal("50.00"), monto_gastado=Decimal("40.00"))
+
+        cajas = set_montos_diarios({existente: 100, nueva: 75.5})
+
+        self.assertEqual(set(cajas), {existente, nueva})
+        caja = CajaDiaria.objects.get(fecha=existente)
+        self.assertEqual(caja.monto_inicial, Decimal("100.00"))
+        self.assertEqual(caja.monto_sobrante, Decimal("60.00"))
+        caja = CajaDiaria.objects.get(fecha=nueva)
+        self.assertEqual(caja.monto_inicial, Decimal("75.50"))
+        self.assertEqual(caja.monto_gastado, Decimal("0.00"))
+        self.assertEqual(caja.monto_sobrante, Decimal("75.50"))
+
+
+class AprobarSolicitudViewTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username="aprobador", password="clave123")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.usuario)
+        self.solicitud = Solicitud.objects.create(
+            solicitante=self.usuario,
+            area="Operaciones",
+            total_soles=Decimal("80.00"),
+            estado="Pendiente para Atención",
+        )
+
+    def test_rechaza_si_no_hay_saldo_suficiente(self):
+        CajaDiaria.objects.create(fecha=timezone.localdate(), monto_inicial=Decimal("50.00"), monto_sobrante=Decimal("50.00"))
+
+        response = self.client.post(reverse("aprobar-solicitud", args=[self.solicitud.id]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("suficiente monto", response.data["error"])
+        self.solicitud.refresh_from_db()
+        self.assertNotEqual(self.solicitud.estado, "Aprobada")
+        self.assertEqual(CajaDiaria.objects.get(fecha=timezone.localdate()).monto_gastado, Decimal("0.00"))
+
+    def test_aprueba_si_hay_saldo(self):
+        CajaDiaria.objects.create(fecha=timezone.localdate(), monto_inicial=Decimal("100.00"), monto_sobrante=Decimal("100.00"))
+
+        response = self.client.post(reverse("aprobar-solicitud", args=[self.solicitud.id]))
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 200)
+        caja = CajaDiaria.objects.get(fecha=timezone.localdate())
+        self.assertEqual(caja.monto_gastado, Decimal("80.00"))
+        self.assertEqual(caja.monto_sobrante, Decimal("20.00"))
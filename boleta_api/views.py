@@ -113,7 +113,9 @@ from .extraccion import (
     detectar_total,
     normalizar_texto_ocr,
     procesar_datos_ocr,
-    archivo_a_imagenes,
+    paginas_para_ocr,
+    ocr_paginas,
+    preparar_para_ocr,
 )
 
 # ---------------------------
@@ -803,6 +805,8 @@ def procesar_documento(request):
                 logger.warning(f"No se pudo borrar el archivo temporal {temp_path}: {e}")
 
 # Liquidaciones Pendientes View
+_RE_CORREO_NOMBRE = re.compile(r"\s*<.*?>")
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def liquidaciones_pendientes(request):
@@ -823,7 +827,7 @@ def liquidaciones_pendientes(request):
                 if hasattr(s.solicitante, "get_full_name"):
                     full_name = s.solicitante.get_full_name()
                     # Elimina cualquier correo entre <>
-                    nombre_solicitante = re.sub(r"\s*<.*?>", "", full_name).strip()
+                    nombre_solicitante = _RE_CORREO_NOMBRE.sub("", full_name).strip()
                     if not nombre_solicitante:
                         nombre_solicitante = str(s.solicitante)
                 else:
@@ -951,7 +955,7 @@ def test_ocr(request):
         return Response({"error": "No se envió ningún archivo"}, status=400)
 
     img = Image.open(archivo)
-    texto_crudo = pytesseract.image_to_string(img, lang="spa")
+    texto_crudo = ocr_paginas([preparar_para_ocr(img)], lang="spa")[0]
 
     print("📄 OCR crudo:")
     print(texto_crudo)
@@ -985,10 +989,10 @@ def guardar_documento(request):
         for idx, doc in enumerate(documentos):
             archivo = archivos[idx] if idx < len(archivos) else None
 
-            # Convertimos archivo a imágenes si necesitas OCR
-            imagenes, _ = archivo_a_imagenes(archivo) if archivo else ([], [])
+            # Un registro por página escaneada: solo se cuentan, sin rasterizar el PDF
+            paginas = paginas_para_ocr(archivo) if archivo else 0
 
-            for pagina_idx, img in enumerate(imagenes or [None]):
+            for pagina_idx in range(paginas or 1):
                 datos_extraidos = doc.copy()
 
                 # Tipo de documento fallback
@@ -1072,6 +1076,26 @@ def obtener_documentos_por_solicitud(request, solicitud_id):
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 # Clasificar Tipo Documento #
+PATRONES_CLASIFICACION = {
+    "recibo": [
+        re.compile(r"RECIB[O0]\s*(POR)?\s*HONORARIOS"),
+        re.compile(r"\bR\.?H\.?\b"),
+        re.compile(r"SERVICIO(S)?\s+PROFESIONAL(ES)?"),
+        re.compile(r"RECIBO\s+N?\.?\s*\d+"),
+    ],
+    "boleta": [
+        re.compile(r"BOLETA\s*(DE)?\s*VENTA"),
+        re.compile(r"\bB\.?V\.?\b"),
+        re.compile(r"\bB0LETA\b"),  # con cero
+    ],
+    "factura": [
+        re.compile(r"FACTURA(\s+ELECTRONICA)?"),
+        re.compile(r"\bF\.?E\.?\b"),
+        re.compile(r"\bF@CTURA\b"),  # error OCR
+        re.compile(r"FACTURA\s+N?\.?\s*\d+"),
+    ],
+}
+
 def clasificar_tipo_documento(ocr_text):
     """
     Clasifica el tipo de documento (boleta, factura o recibo por honorarios)
@@ -1084,29 +1108,9 @@ def clasificar_tipo_documento(ocr_text):
 
     texto = normalizar(ocr_text)
 
-    patrones = {
-        "recibo": [
-            r"RECIB[O0]\s*(POR)?\s*HONORARIOS",
-            r"\bR\.?H\.?\b",
-            r"SERVICIO(S)?\s+PROFESIONAL(ES)?",
-            r"RECIBO\s+N?\.?\s*\d+"
-        ],
-        "boleta": [
-            r"BOLETA\s*(DE)?\s*VENTA",
-            r"\bB\.?V\.?\b",
-            r"\bB0LETA\b",  # con cero
-        ],
-        "factura": [
-            r"FACTURA(\s+ELECTRONICA)?",
-            r"\bF\.?E\.?\b",
-            r"\bF@CTURA\b",  # error OCR
-            r"FACTURA\s+N?\.?\s*\d+"
-        ]
-    }
-
-    for tipo, expresiones in patrones.items():
+    for tipo, expresiones in PATRONES_CLASIFICACION.items():
         for patron in expresiones:
-            if re.search(patron, texto):
+            if patron.search(texto):
                 return tipo
 
     return "desconocido"
@@ -1295,14 +1299,18 @@ class CajaDiariaView(APIView):
                 'error': f'El monto ingresado ({monto_base}) supera el límite diario permitido ({MAX_MONTO_DIARIO}).'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Acumular sobrantes de días anteriores
+        # Acumular sobrantes de días anteriores (una sola consulta para los 30 días)
         sobrante_acumulado = 0.0
         fecha_iter = fecha_hoy - timedelta(days=1)
+        sobrantes = dict(
+            CajaDiaria.objects
+            .filter(fecha__range=[fecha_hoy - timedelta(days=30), fecha_iter])
+            .values_list('fecha', 'monto_sobrante')
+        )
 
         while fecha_iter >= fecha_hoy - timedelta(days=30):
-            caja_dia = CajaDiaria.objects.filter(fecha=fecha_iter).first()
-            if caja_dia:
-                sobrante_acumulado += float(caja_dia.monto_sobrante)
+            if fecha_iter in sobrantes:
+                sobrante_acumulado += float(sobrantes[fecha_iter])
                 fecha_iter -= timedelta(days=1)
             else:
                 break
@@ -1577,19 +1585,22 @@ class CrearSolicitudGastoView(generics.CreateAPIView):
 @permission_classes([IsAuthenticated])
 def aprobar_solicitud_view(request, solicitud_id):
     try:
-        solicitud = Solicitud.objects.get(id=solicitud_id)
-        if solicitud.estado == "Aprobada":
-            return Response({"error": "Solicitud ya aprobada"}, status=400)
+        # Solicitud y caja bloqueadas hasta aprobar: dos aprobaciones simultáneas
+        # no pueden pasar ambas la verificación de saldo
+        with transaction.atomic():
+            solicitud = Solicitud.objects.select_for_update().get(id=solicitud_id)
+            if solicitud.estado == "Aprobada":
+                return Response({"error": "Solicitud ya aprobada"}, status=400)
 
-        fecha_hoy = date.today()
-        caja, creado = CajaDiaria.objects.get_or_create(fecha=fecha_hoy)
-        monto_disponible = float(caja.monto_inicial or 0) - float(caja.monto_gastado or 0)
+            fecha_hoy = timezone.localdate()
+            caja, creado = CajaDiaria.objects.select_for_update().get_or_create(fecha=fecha_hoy)
+            monto_disponible = (caja.monto_inicial or Decimal("0")) - (caja.monto_gastado or Decimal("0"))
 
-        if float(solicitud.monto_soles or 0) > monto_disponible:
-            return Response({"error": "No hay suficiente monto disponible para aprobar esta solicitud"}, status=400)
+            if Decimal(solicitud.total_soles or 0) > monto_disponible:
+                return Response({"error": "No hay suficiente monto disponible para aprobar esta solicitud"}, status=400)
 
-        # Llamar función que aprueba y actualiza caja
-        aprobar_solicitud(solicitud_id)
+            # Llamar función que aprueba y actualiza caja
+            aprobar_solicitud(solicitud_id)
 
         return Response({"mensaje": "Solicitud aprobada correctamente"})
 